@@ -12,13 +12,15 @@ else:
     GDB = True
 
 from gxf.cyclic import *
+from gxf.elf import *
 
 if GDB:
     from gxf.formatting import *
     from gxf.basics import *
     from gxf.commands import *
+    from gxf.events import *
     from gxf.disassembly import *
     from gxf.errors import *
     from gxf.cpu import *
     from gxf.memory import *
-    from gxf.events import *
+    from gxf.snapshots import *
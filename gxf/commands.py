@@ -31,12 +31,37 @@ class GdbCompleter(object):
 class LocationType(object):
     argcompleter = GdbCompleter(gdb.COMPLETE_LOCATION)
 
+    def relative(self, arg):
+        """
+        Understands backing+offset such as libc.so.6+0x1234 or [stack]+8.
+        This is only tried for what gdb itself couldn't evaluate.
+        """
+
+        if "+" not in arg:
+            return None
+
+        backing, offset = arg.rsplit("+", 1)
+        try:
+            offset = int(offset, 0)
+            memory = gxf.get_memory()
+        except (ValueError, gdb.error):
+            return None
+
+        addr = memory.lookup(backing.strip(), offset)
+        if addr is None:
+            return None
+
+        return gdb.Value(addr).cast(gdb.lookup_type("void").pointer())
+
     def __call__(self, arg):
 
         try:
             value = gdb.parse_and_eval(arg)
         except Exception as e:
-            raise argparse.ArgumentTypeError(e)
+            value = self.relative(arg)
+            if value is None:
+                raise argparse.ArgumentTypeError(e)
+            return value
         if value.address is not None:
             value = value.address
         return value
@@ -8,6 +8,12 @@ def get_addrsz():
     return int(gxf.parse_and_eval("sizeof (void *)"))
 
 
+def get_byteorder():
+    if "big endian" in gxf.execute("show endian"):
+        return "big"
+    return "little"
+
+
 class Registers(object):
 
     EFLAGS_CF = 1 << 0
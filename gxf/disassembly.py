@@ -1,5 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
+import re
+import array
+import bisect
+import itertools
+import json
+import binascii
+
 import pygments
 from pygments.lexers import NasmLexer, GasLexer
 from pygments.filter import Filter
@@ -108,10 +116,14 @@ class GdbLexer(DelegatingLexer):
                          ["xmm%d" % i for i in range(16)])
 
     def get_tokens_unprocessed(self, text):
-        for index, token, value in super().get_tokens_unprocessed(text):
-            if token is Token.Name.Variable and value in self.EXTRA_BUILTINS:
+        return self.remap(super().get_tokens_unprocessed(text))
+
+    @classmethod
+    def remap(cls, stream):
+        for index, token, value in stream:
+            if token is Token.Name.Variable and value in cls.EXTRA_BUILTINS:
                 yield index, Token.Name.Builtin, value
-            elif token is Token.Name.Variable and value in self.EXTRA_KEYWORDS:
+            elif token is Token.Name.Variable and value in cls.EXTRA_KEYWORDS:
                 yield index, Token.Keyword.Type, value
             elif token is Token.Punctuation:
                 for c in value:
@@ -149,30 +161,31 @@ class CurrentFunctiontFilter(Filter):
 
 class PrefixFilter(Filter):
 
+    # gdb prints those in lower case, except for rex's bits.
     prefixes = set(("ES", "CS", "NTAKEN", "SS", "DS", "TAKEN",
                     "REX", "REX.B", "REX.X", "REX.XB", "REX.R", "REX.RB",
                     "REX.RX", "REX.RXB", "REX.W", "REX.WB", "REX.WX",
                     "REX.WXB", "REX.WR", "REX.WRB", "REX.WRX", "REX.WRXB",
                     "FS", "ALTER", "GS", "LOCK",
-                    "REPNZ", "REP",
-                    "data16", "addr16", "data32", "addr32"))
+                    "REPNZ", "REPNE", "REPZ", "REPE", "REP", "BND", "NOTRACK",
+                    "DATA16", "ADDR16", "DATA32", "ADDR32"))
 
     def filter(self, lexer, stream):
 
         prefix = False
         for ttype, value in stream:
 
-            if prefix and ttype is Token.Name.Variable:
-                if value in self.prefixes:
+            # Some prefixes, like segments, look like registers.
+            if ttype is Token.Name.Function or prefix and \
+                    ttype in (Token.Name.Variable, Token.Name.Builtin):
+                if value.upper() in self.prefixes:
+                    prefix = True
                     ttype = Token.Keyword.Type
-                else:
+                elif prefix:
+                    prefix = False
                     ttype = Token.Name.Function
 
-            elif ttype is Token.Name.Function and value in self.prefixes:
-                prefix = True
-                ttype = Token.Keyword.Type
-
-            elif ttype is not Token.Text:
+            elif ttype not in Token.Text:
                 prefix = False
 
             yield ttype, value
@@ -200,21 +213,23 @@ class AlignementFilter(Filter):
             median = sorted(hexdumps.values())[int(len(hexdumps) * 0.9)]
 
             for i, count in hexdumps.items():
-                token = lexed[i + count - 1]
-                value = token[1]
+                lexed[i + count - 1][1] += padding(count, median) * 3 * ' '
 
-                backoff = 2
-                padding = median
-                while padding < count:
-                    padding += backoff
-                    backoff *= 2
+        yield from lexed
 
-                padding = int(padding) - count
-                value += padding * 3 * ' '
 
-                token[1] += value
+def padding(count, median):
+    """
+    How many bytes a hexdump of count bytes should be padded with.
+    """
 
-        yield from lexed
+    backoff = 2
+    padding = median
+    while padding < count:
+        padding += backoff
+        backoff *= 2
+
+    return int(padding) - count
 
 
 currentfunctiontfilter = CurrentFunctiontFilter()
@@ -223,6 +238,353 @@ lexer.add_filter(PrefixFilter())
 lexer.add_filter(currentfunctiontfilter)
 lexer.add_filter(AlignementFilter())
 
+
+# The tokenizer does what the lexer above does, in a single pass and
+# without pygments which is the slowest part of showing disassembly.
+# Its rules are those of pygments' lexers, they are kept as they are so
+# both give the same tokens, even where they're a bit odd.
+
+
+def _state(flags, rules):
+    """
+    Compiles (regex, token or tuple of tokens, transition) rules into a
+    single regex, the group of a match tells which rule it was.
+    """
+
+    parts, actions = [], {}
+    group = 1
+    for regex, ttype, transition in rules:
+        actions[group] = ttype, transition
+        parts.append("(%s)" % regex)
+        group += 1 + re.compile(regex, flags).groups
+
+    return re.compile("|".join(parts), flags).match, actions
+
+
+def _nasm():
+
+    L = NasmLexer
+    flags = re.IGNORECASE | re.MULTILINE
+
+    whitespace = [
+        (r'\n', Token.Text.Whitespace, None),
+        (r'[ \t]+', Token.Text.Whitespace, None),
+        (r';.*', Token.Comment.Single, None),
+        (r'#.*', Token.Comment.Single, None),
+        ]
+
+    return {
+        'root': _state(flags, [
+            (r'^\s*%', Token.Comment.Preproc, 'preproc')] + whitespace + [
+            (L.identifier + ':', Token.Name.Label, None),
+            (r'(%s)(\s+)(equ)' % L.identifier, (
+                Token.Name.Constant, Token.Text.Whitespace,
+                Token.Keyword.Declaration), 'instruction-args'),
+            (L.directives, Token.Keyword, 'instruction-args'),
+            (L.declkw, Token.Keyword.Declaration, 'instruction-args'),
+            (L.identifier, Token.Name.Function, 'instruction-args'),
+            (r'[\r\n]+', Token.Text.Whitespace, None),
+            ]),
+        'instruction-args': _state(flags, [
+            (L.string, Token.String, None),
+            (L.hexn, Token.Number.Hex, None),
+            (L.octn, Token.Number.Oct, None),
+            (L.binn, Token.Number.Bin, None),
+            (L.floatn, Token.Number.Float, None),
+            (L.decn, Token.Number.Integer, None),
+            (r'[,{}():\[\]]+', Token.Punctuation, None),
+            (r'[&|^<>+*/%~-]+', Token.Operator, None),
+            (r'[$]+', Token.Keyword.Constant, None),
+            (L.wordop, Token.Operator.Word, None),
+            (L.type, Token.Keyword.Type, None),
+            (L.register, Token.Name.Builtin, None),
+            (L.identifier, Token.Name.Variable, None),
+            (r'[\r\n]+', Token.Text.Whitespace, '#pop'),
+            ] + whitespace),
+        'preproc': _state(flags, [
+            (r'[^;\n]+', Token.Comment.Preproc, None),
+            (r';.*?\n', Token.Comment.Single, '#pop'),
+            (r'\n', Token.Comment.Preproc, '#pop'),
+            ]),
+        }
+
+
+def _gas():
+
+    L = GasLexer
+    flags = re.MULTILINE
+
+    whitespace = [
+        (r'\n', Token.Text.Whitespace, None),
+        (r'\s+', Token.Text.Whitespace, None),
+        (r'([;#]|//).*?\n', Token.Comment.Single, None),
+        (r'/[*][\w\W]*?[*]/', Token.Comment.Multiline, None),
+        ]
+
+    args = [
+        (r'[\r\n]+', Token.Text.Whitespace, '#pop'),
+        (r'([;#]|//).*?\n', Token.Comment.Single, '#pop'),
+        (r'/[*].*?[*]/', Token.Comment.Multiline, None),
+        (r'/[*].*?\n[\w\W]*?[*]/', Token.Comment.Multiline, '#pop'),
+        (r'[-*,.()\[\]!:{}]+', Token.Punctuation, None),
+        ] + whitespace
+
+    symbol = (Token.Number.Hex, Token.Text, Token.Punctuation,
+              Token.Name.Constant, Token.Punctuation)
+    offsetsymbol = symbol[:4] + (Token.Punctuation, Token.Number.Integer,
+                                 Token.Punctuation)
+
+    return {
+        'root': _state(flags, whitespace + [
+            (L.identifier + ':', Token.Name.Label, None),
+            (r'\.' + L.identifier, Token.Name.Attribute, 'directive-args'),
+            (r'lock|rep(n?z)?|data\d+', Token.Name.Attribute, None),
+            (L.identifier, Token.Name.Function, 'instruction-args'),
+            (r'[\r\n]+', Token.Text, None),
+            ]),
+        'directive-args': _state(flags, [
+            (L.identifier, Token.Name.Constant, None),
+            (L.string, Token.String, None),
+            ('@' + L.identifier, Token.Name.Attribute, None),
+            (L.number, Token.Number.Integer, None),
+            (L.register, Token.Name.Variable, None),
+            ] + args),
+        'instruction-args': _state(flags, [
+            ('([a-z0-9]+)( )(<)(' + L.identifier + ')(>)', symbol, None),
+            ('([a-z0-9]+)( )(<)(%s)([-+])(%s)(>)' % (L.identifier, L.number),
+             offsetsymbol, None),
+            (L.identifier, Token.Name.Constant, None),
+            (L.number, Token.Number.Integer, None),
+            (L.register, Token.Name.Variable, None),
+            ('$' + L.number, Token.Number.Integer, None),
+            (r"$'(.|\\')'", Token.String.Char, None),
+            ] + args),
+        }
+
+
+class Tokenizer(object):
+    """
+    Splits gdb's disassembly in the tokens GdbLexer, PrefixFilter,
+    CurrentFunctiontFilter and AlignementFilter would give, for the
+    intel and att flavors. Lines are lexed from a clean state, pygments
+    sometimes keeps GasLexer's state from one line to the next.
+    """
+
+    states = {
+        'intel': _nasm,
+        'att': _gas,
+        }
+
+    # gdb's context, see GdbContextLexer.
+    context = re.compile(
+        r'([ \t]+)|(=>)|(0x[0-9a-f]+)|([0-9a-f]{2}[ \t])|(\(bad\))').match
+    contexttypes = (None, Token.Text, Token.Comment, Token.Comment,
+                    Token.Comment.Special, Token.Comment)
+
+    location = re.compile(
+        r'([ \t]+)|(:)|(<)(.*)(\+)([0-9]+)(>)(:)').match
+    locationtypes = (None, Token.Text, Token.Comment, Token.Operator,
+                     Token.Name.Variable, Token.Operator,
+                     Token.Literal.Number.Integer, Token.Operator,
+                     Token.Comment)
+
+    # Most lines look like this, they're done in a single match that
+    # gives the same tokens as the rules above.
+    common = re.compile(
+        r'(?:(=>)([ \t]+)|([ \t]+))?(0x[0-9a-f]+)([ \t]+)?'
+        r'(?:(:)|(<)(.*)(\+)([0-9]+)(>)(:))([ \t]+)?'
+        r'((?:[0-9a-f]{2}[ \t])*)').match
+    commontypes = (None, Token.Comment, Token.Text, Token.Text,
+                   Token.Comment, Token.Text, Token.Comment) + \
+        locationtypes[3:] + (Token.Text, )
+
+    def __init__(self, flavor):
+        self.flavor = flavor
+        self.asm = self.states[flavor]()
+
+    def tokenize(self, text, function=None):
+        """
+        Returns the tokens of each line of text with aligned hexdumps.
+        """
+
+        lines = [self.line(line, function)
+                 for line in text.strip("\n").split("\n")]
+
+        hexdumps = [[i for i, token in enumerate(line)
+                     if token[0] is Token.Comment.Special] for line in lines]
+
+        counts = sorted(len(hexdump) for hexdump in hexdumps if hexdump)
+        if counts:
+            median = counts[int(len(counts) * 0.9)]
+            for line, hexdump in zip(lines, hexdumps):
+                if hexdump:
+                    i = hexdump[-1]
+                    line[i] = line[i][0], line[i][1] + padding(
+                        len(hexdump), median) * 3 * ' '
+
+        return lines
+
+    def line(self, text, function=None):
+        """
+        Returns the tokens of a single line of gdb's disassembly, an
+        instruction alone is fine too. Hexdumps aren't padded.
+        """
+
+        tokens = []
+        pos, end = 0, len(text)
+
+        m = self.common(text)
+        if m is not None:
+            for g, ttype in enumerate(self.commontypes[1:14], 1):
+                value = m.group(g)
+                if value:
+                    if ttype is Token.Name.Variable:
+                        ttype = _remapname(value)
+                    tokens.append((ttype, value))
+                elif g == 8 and m.group(7):
+                    tokens.append((Token.Name.Variable, function))
+            hexdump = m.group(14)
+            tokens.extend((Token.Comment.Special, hexdump[i:i + 2] + ' ')
+                          for i in range(0, len(hexdump), 3))
+            pos = m.end()
+
+        while pos < end:
+
+            m = self.context(text, pos)
+            if m is None:
+                break
+
+            i = m.lastindex
+            if i == 4:
+                tokens.append((Token.Comment.Special, m.group().strip() + ' '))
+            else:
+                tokens.append((self.contexttypes[i], m.group()))
+            pos = m.end()
+
+            if i != 3:
+                continue
+
+            # After an address there can be a location.
+            while pos < end:
+                m = self.location(text, pos)
+                if m is None:
+                    tokens.append((Token.Error, text[pos]))
+                    pos += 1
+                    continue
+                if m.lastindex == 1:
+                    tokens.append((Token.Text, m.group()))
+                    pos = m.end()
+                    continue
+                for g in (2,) if m.lastindex == 2 else range(3, 9):
+                    value = m.group(g)
+                    if value:
+                        ttype = self.locationtypes[g]
+                        if ttype is Token.Name.Variable:
+                            ttype = _remapname(value)
+                        tokens.append((ttype, value))
+                    elif g == 4:
+                        # This is what CurrentFunctiontFilter is for.
+                        tokens.append((Token.Name.Variable, function))
+                pos = m.end()
+                break
+            else:
+                # That's an error at the end of the line, for pygments.
+                return tokens
+
+        code, sep, comment = text[pos:].partition("#")
+        self.lexasm(code, tokens)
+        if sep:
+            tokens.append((Token.Comment, sep + comment))
+
+        return tokens
+
+    def lexasm(self, code, tokens):
+        """
+        Lexes the instruction itself the way the flavor's lexer does,
+        followed by GdbLexer.remap and PrefixFilter.
+        """
+
+        text = code + "\n"
+        pos, end = 0, len(code)
+        stack = ['root']
+        match, actions = self.asm['root']
+
+        append = tokens.append
+        prefix = False
+
+        while pos < end:
+
+            m = match(text, pos)
+            if m is None:
+                append((Token.Error, text[pos]))
+                prefix = False
+                pos += 1
+                continue
+
+            group = m.lastindex
+            ttype, transition = actions[group]
+            stop = m.end()
+
+            if type(ttype) is tuple:
+                values = [(t, text[m.start(i):min(m.end(i), end)])
+                          for i, t in enumerate(ttype, group + 1)]
+            else:
+                values = ((ttype, text[pos:stop if stop < end else end]),)
+
+            for ttype, value in values:
+
+                if not value:
+                    continue
+
+                if ttype is Token.Punctuation:
+                    for c in value:
+                        append((Token.Operator if c in "+-*/%^&" else ttype,
+                                c))
+                    prefix = False
+                    continue
+
+                if ttype is Token.Name.Variable:
+                    ttype = _remapname(value)
+
+                if ttype is Token.Name.Function or prefix and \
+                        ttype in (Token.Name.Variable, Token.Name.Builtin):
+                    if value.upper() in PrefixFilter.prefixes:
+                        prefix = True
+                        ttype = Token.Keyword.Type
+                    elif prefix:
+                        prefix = False
+                        ttype = Token.Name.Function
+
+                elif ttype not in Token.Text:
+                    prefix = False
+
+                append((ttype, value))
+
+            pos = stop
+
+            if transition is None:
+                continue
+            elif transition == '#pop':
+                if len(stack) > 1:
+                    stack.pop()
+            else:
+                stack.append(transition)
+            match, actions = self.asm[stack[-1]]
+
+
+def _remapname(value):
+    """
+    What GdbLexer.remap does to a Name.Variable.
+    """
+    if value in GdbLexer.EXTRA_BUILTINS:
+        return Token.Name.Builtin
+    elif value in GdbLexer.EXTRA_KEYWORDS:
+        return Token.Keyword.Type
+    return Token.Name.Variable
+
+
+tokenizer = Tokenizer(disassemblyflavor.value)
+
 JMP = "jmp"
 CALL = "call"
 SYSCALL = "syscall"
@@ -240,12 +602,104 @@ class DisassemblyLine(gxf.Formattable):
         TEST: Token.Generic.Strong,
         }
 
-    def __init__(self, tokens):
+    # Those only exist once the line was lexed, the instruction only
+    # needs the tokens of the instruction itself.
+    lexed = ("tokens", "addressidx", "instidx")
+    instruction = ("inst", "itype")
+
+    def __init__(self, tokens=None, address=None, asm=None,
+                 bytecode=b"", current=False, location=None, entry=None):
+
+        if tokens is not None:
+            self._parse(tokens)
+            return
+
+        # This comes from the structured backend, we know everything
+        # we need and lexing waits until someone wants the tokens.
+        self.address = address
+        self.asm = asm
+        self.bytecode = bytes(bytecode)
+        self.length = len(self.bytecode)
+        self.current = current
+        self.location = location
+        self.function = location[0] if location else None
+
+        # The cache's entry, it gets our tokens once we're lexed.
+        self.entry = entry
+        self.asmtokens = entry[2] if entry is not None else None
+
+    def __getattr__(self, name):
+        if name in self.instruction:
+            if self.asmtokens is None:
+                lex_instructions([self])
+            self._instruction()
+            return self.__dict__[name]
+        if name in self.lexed:
+            lex_lines([self])
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def text(self):
+        """
+        The line as `disassemble /r` would have printed it.
+        """
+        if "asm" not in self.__dict__:
+            return "".join(value for _, value in self.tokens) + "\n"
+        return "%s%#018x%s:\t%s\t%s\n" % (
+            "=> " if self.current else "   ", self.address,
+            " <%s+%d>" % self.location if self.location else "",
+            " ".join("%02x" % b for b in self.bytecode), self.asm)
+
+    def _build(self, padding=0):
+        """
+        Builds the tokens the lexer would have found in text(), only
+        the instruction itself needs to have been lexed.
+        """
+
+        if self.current:
+            tokens = [(Token.Comment, "=>"), (Token.Text, " ")]
+        else:
+            tokens = [(Token.Text, "   ")]
+
+        tokens.append((Token.Comment, "%#018x" % self.address))
+        if self.location:
+            tokens.extend(location_tokens(*self.location))
+        tokens.extend(((Token.Comment, ":"), (Token.Text, "\t")))
+
+        hexdump = ["%02x " % b for b in self.bytecode]
+        if hexdump:
+            hexdump[-1] += padding * 3 * " "
+        tokens.extend((Token.Comment.Special, h) for h in hexdump)
+
+        start = len(tokens)
+        tokens.extend(self.asmtokens)
+        index = self._instruction()
+
+        self.tokens = tokens
+        self.addressidx = 2 if self.current else 1
+        self.instidx = None if index is None else start + index
+
+    def _instruction(self):
+        """
+        Finds the instruction in the instruction's own tokens, the same
+        way _parse does for a whole line. Returns its index there.
+        """
+
+        index = None
+        self.inst = None
+        for i, (ttype, value) in enumerate(self.asmtokens):
+            if ttype is Token.Name.Function:
+                self.inst, index = value, i
+        self.itype = self._itype()
+        return index
+
+    def _parse(self, tokens):
         self.tokens = tokens
         self.address = None
         self.addressidx = None
         self.inst = None
         self.instidx = None
+        self.function = None
 
         self.bytecode = []
 
@@ -262,6 +716,9 @@ class DisassemblyLine(gxf.Formattable):
             if ttype is Token.Comment.Special:
                 self.bytecode.extend(int(v, 16) for v in value.split())
 
+            if ttype is Token.Name.Variable and self.inst is None:
+                self.function = value
+
             if ttype is Token.Name.Function:
 
                 self.inst = value
@@ -269,21 +726,40 @@ class DisassemblyLine(gxf.Formattable):
 
         self.bytecode = bytes(self.bytecode)
         self.length = len(self.bytecode)
+        self.itype = self._itype()
 
+    def _itype(self):
         if self.inst is None:
-            self.itype = None
+            return None
         elif self.inst.startswith("j"):
-            self.itype = JMP
+            return JMP
         elif self.inst.startswith("call"):
-            self.itype = CALL
+            return CALL
         elif self.inst.startswith("syscall"):
-            self.itype = SYSCALL
+            return SYSCALL
         elif "ret" in self.inst:
-            self.itype = RET
+            return RET
         elif "cmp" in self.inst or self.inst == "test":
-            self.itype = TEST
-        else:
-            self.itype = None
+            return TEST
+        return None
+
+    def set_location(self, function, offset):
+        """
+        Adds a <function+offset> location, for when gdb didn't know one.
+        """
+
+        if "tokens" not in self.__dict__:
+            self.location = function, offset
+            self.function = function
+            return
+
+        tokens = location_tokens(function, offset)
+
+        i = self.addressidx + 1
+        self.tokens[i:i] = tokens
+        if self.instidx is not None:
+            self.instidx += len(tokens)
+        self.function = function
 
     def fmttokens(self, hexdump=False, offset=0,
                   skipleading=False, style=True):
@@ -495,27 +971,24 @@ class DisassemblyLine(gxf.Formattable):
 
 class DisassemblyBlock(gxf.Formattable):
 
-    # TODO: lexing is slow (seems legit)
-    # check if we can speed this up.
-
-    def __init__(self, disassembly, lexer=lexer, msg=None):
+    def __init__(self, disassembly, lexer=None, msg=None):
 
         self.lines = []
         if isinstance(disassembly, list):
             self.lines = disassembly
         elif disassembly:
-            line = []
             if msg:
                 current_function = msg.rsplit(None, 1)[-1][:-1]
             else:
                 current_function = None
-            with currentfunctiontfilter.current_function(current_function):
-                for ttype, value in pygments.lex(disassembly, lexer):
-                    if '\n' in value:
-                        self.lines.append(DisassemblyLine(line))
-                        line = []
-                    else:
-                        line.append((ttype, value))
+            if lexer is None:
+                lines = tokenizer.tokenize(disassembly, current_function)
+                self.lines = [DisassemblyLine(tokens) for tokens in lines]
+            else:
+                # The pygments lexer is slower, it's still good to compare.
+                self.lines = self._lex(disassembly, lexer, current_function)
+
+            symbolize(self.lines)
 
         self.linenos = {}
         for i, line in enumerate(self.lines):
@@ -524,6 +997,19 @@ class DisassemblyBlock(gxf.Formattable):
         self.lexer = lexer
         self.msg = msg
 
+    @staticmethod
+    def _lex(disassembly, lexer, current_function):
+        lines = []
+        line = []
+        with currentfunctiontfilter.current_function(current_function):
+            for ttype, value in pygments.lex(disassembly, lexer):
+                if '\n' in value:
+                    lines.append(DisassemblyLine(line))
+                    line = []
+                else:
+                    line.append((ttype, value))
+        return lines
+
     def get_lineno_for_addr(self, addr):
         best = None, None
         for i, line in enumerate(self.lines):
@@ -533,6 +1019,7 @@ class DisassemblyBlock(gxf.Formattable):
         return best
 
     def fmttokens(self, hexdump=False, start=None, stop=None):
+        lex_lines(self.lines[start:stop])
         for line in self.lines[start:stop]:
             yield from line.fmttokens(hexdump=hexdump)
             yield (Token.Text, "\n")
@@ -552,13 +1039,727 @@ class DisassemblyBlock(gxf.Formattable):
         yield from self.lines
 
 
+def symbolize(lines):
+    """
+    Gives the lines gdb had no symbol for one from our own index, this
+    helps a lot with stripped binaries.
+    """
+
+    try:
+        memory = gxf.get_memory()
+    except ValueError:
+        # Not running, gdb knows as much as we do.
+        return
+
+    for line in lines:
+        if line.address is not None and line.function is None:
+            symbol = memory.symbolize(line.address)
+            if symbol is not None:
+                line.set_location(*symbol)
+
+
+def location_tokens(function, offset):
+    return [(Token.Text, " "), (Token.Operator, "<"),
+            (Token.Name.Variable, function), (Token.Operator, "+"),
+            (Token.Literal.Number.Integer, "%d" % offset),
+            (Token.Operator, ">")]
+
+
+def lex_lines(lines):
+    """
+    Gives their tokens to the lines from the structured backend that
+    don't have them yet. Only instructions that weren't cached need to
+    go through the tokenizer, the hexdumps are aligned together.
+    """
+
+    todo = [line for line in lines if "tokens" not in line.__dict__]
+    if not todo:
+        return
+
+    lex_instructions([line for line in todo if line.asmtokens is None])
+
+    counts = sorted(line.length for line in todo if line.length)
+    median = counts[int(len(counts) * 0.9)] if counts else 0
+
+    for line in todo:
+        line._build(padding(line.length, median) if line.length else 0)
+
+
+def _keep(line):
+    if line.entry is not None:
+        line.entry[2] = line.asmtokens
+
+
+def lex_instructions(lines):
+    """
+    Lexes the instructions of lines and keeps the tokens in the cache.
+    """
+
+    for line in lines:
+        line.asmtokens = tuple(tokenizer.line(line.asm))
+        _keep(line)
+
+
+class DisassemblyCacheDir(gdb.Parameter):
+    """
+    When this is set the disassembly cache is saved to this directory,
+    one file per build-id, and reused by the next sessions.
+    """
+
+    set_doc = "Set the directory where decoded instructions are saved."
+    show_doc = "Show the directory where decoded instructions are saved."
+
+    def __init__(self):
+        super().__init__("gx-disassembly-cache", gdb.COMMAND_DATA,
+                         gdb.PARAM_OPTIONAL_FILENAME)
+
+    def get_set_string(self):
+        return ""
+
+    def get_show_string(self, svalue):
+        return "Decoded instructions are saved to %r." % svalue
+
+
+disassemblycachedir = DisassemblyCacheDir()
+
+dfltcachesize = 1 << 18
+
+# Those are the addresses gdb puts in the text, branch targets and the
+# ones it annotates. It's not a problem if we also catch constants.
+addressre = re.compile(r"0x[0-9a-f]+")
+
+
+class DisassemblyCache(object):
+    """
+    Decoded instructions and their lexed tokens, shared by all commands
+    and kept across stops. Entries are keyed by (arch, flavor, address)
+    and only used while the bytes they were decoded from are still
+    there, that's what makes writes, breakpoints or a new objfile at the
+    same address invalidate them.
+
+    It also remembers where backward disassembly synced for a target
+    address, that start is only used if it still leads there.
+
+    Saved entries are relative to their file, including the addresses
+    in their text since the file is mapped elsewhere next time.
+    """
+
+    version = 1
+
+    def __init__(self, maxsize=dfltcachesize):
+        self.maxsize = maxsize
+        self.entries = {}
+        self.files = {}
+        self.syncs = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, arch, flavor, addr, data, offset):
+        """
+        Returns [bytecode, asm, tokens] for the instruction at addr if
+        data[offset:] starts with the same bytes.
+        """
+
+        entry = self.entries.get((arch, flavor, addr))
+        if entry is None:
+            return None
+
+        bytecode = entry[0]
+        if data[offset:offset + len(bytecode)] != bytecode:
+            return None
+
+        return entry
+
+    def decode(self, arch, flavor, startaddr, endaddr, data, base):
+        """
+        Decodes the instructions from startaddr to endaddr, data holds
+        the bytes starting at base. Raises gxf.MemoryError if not even
+        the first one can be read.
+        """
+
+        if len(self.entries) >= self.maxsize:
+            self.entries.clear()
+            self.syncs.clear()
+
+        name = arch.name()
+        for insn in self._disassemble(arch, startaddr, endaddr):
+            addr, length = insn["addr"], insn["length"]
+            offset = addr - base
+            if offset + length > len(data):
+                break
+            self.entries[name, flavor, addr] = [
+                bytes(data[offset:offset + length]), insn["asm"], None]
+
+    @staticmethod
+    def _disassemble(arch, startaddr, endaddr):
+        """
+        gdb gives nothing at all when one instruction goes over what
+        can be read, those before it are then decoded one at a time.
+        """
+
+        try:
+            return arch.disassemble(startaddr, endaddr - 1)
+        except gdb.MemoryError as e:
+            error = e
+
+        insns = []
+        addr = startaddr
+        while addr < endaddr:
+            try:
+                insn = arch.disassemble(addr)[0]
+            except gdb.MemoryError:
+                break
+            insns.append(insn)
+            addr += insn["length"]
+
+        if not insns:
+            raise gxf.MemoryError(error)
+        return insns
+
+    def load(self, memory, addr):
+        """
+        Loads what was saved for the file mapped at addr, this is only
+        tried once per file and process.
+        """
+
+        m = memory.mapindex.find(addr)
+        if m is None or not m.backing or m.backing in self.files:
+            return
+
+        self.files[m.backing] = None
+
+        dirname = disassemblycachedir.value
+        if not dirname or not m.backing.startswith("/"):
+            return
+
+        try:
+            with gxf.ELF(m.backing) as elf:
+                build_id = elf.build_id
+        except (IOError, ValueError):
+            return
+
+        if build_id is None:
+            return
+
+        end = max(mm.end for mm in memory.maps if mm.backing == m.backing)
+        self.files[m.backing] = build_id, m.base, end
+
+        try:
+            with open(os.path.join(dirname, build_id + ".json")) as f:
+                saved = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        if not isinstance(saved, dict) or \
+           saved.get("version") != self.version:
+            return
+
+        for arch, flavor, offset, bytecode, asm in saved["entries"]:
+            asm = "".join(piece if isinstance(piece, str) else
+                          "%#x" % (m.base + piece) for piece in asm)
+            self.entries.setdefault((arch, flavor, m.base + offset), [
+                binascii.unhexlify(bytecode), asm, None])
+
+    @staticmethod
+    def relocate(asm, base, end):
+        """
+        Splits asm in text and offsets for the addresses within base and
+        end. Returns None if it mentions an address outside of those.
+        """
+
+        pieces = []
+        last = 0
+
+        for match in addressre.finditer(asm):
+
+            addr = int(match.group(), 16)
+            if not base <= addr < end:
+                annotated = asm.startswith(" <", match.end())
+                if annotated or asm.endswith("# ", 0, match.start()):
+                    return None
+                continue
+
+            pieces.append(asm[last:match.start()])
+            pieces.append(addr - base)
+            last = match.end()
+
+        pieces.append(asm[last:])
+        return pieces
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the entries of the files that were loaded, addresses are
+        made relative to their first mapping.
+        """
+
+        files, self.files = self.files, {}
+
+        dirname = disassemblycachedir.value
+        if not dirname:
+            return
+
+        for found in files.values():
+
+            if found is None:
+                continue
+            build_id, base, end = found
+
+            saved = []
+            for (arch, flavor, addr), entry in self.entries.items():
+                if not base <= addr < end:
+                    continue
+                asm = self.relocate(entry[1], base, end)
+                if asm is not None:
+                    saved.append((arch, flavor, addr - base, binascii.hexlify(
+                        entry[0]).decode("ascii"), asm))
+
+            if not saved:
+                continue
+
+            os.makedirs(dirname, exist_ok=True)
+            with open(os.path.join(dirname, build_id + ".json"), "w") as f:
+                json.dump({"version": self.version, "entries": saved}, f)
+
+    def clear(self, *args, **kwargs):
+        self.save()
+        self.entries.clear()
+        self.syncs.clear()
+
+
+disassemblycache = DisassemblyCache()
+
+# The addresses we know are only good for this process and program,
+# and the symbols gdb annotates them with change with the objfiles.
+gxf.events.exited.connect(disassemblycache.save)
+gxf.events.clear_objfiles.connect(disassemblycache.clear)
+gxf.events.new_objfile.connect(disassemblycache.clear)
+if gxf.events.exiting is not None:
+    gxf.events.exiting.connect(disassemblycache.save)
+
+
+# The structured backend decodes with gdb's Architecture.disassemble and
+# reads the instructions' bytes in bulk, we fallback on the text one.
+
+dfltbackend = "structured"
+
+
+class BackendUnavailable(Exception):
+    """
+    The structured backend can't be used, gdb is too old or nothing is
+    running. The text one can.
+    """
+
+
+class NoFunctionError(gdb.error):
+    """
+    No function we know of contains an address, gdb's disassemble might
+    still find one among its minimal symbols.
+    """
+
+
+def _target():
+    """
+    Returns the selected frame, its architecture and the memory the
+    structured backend works on.
+    """
+
+    if not hasattr(gdb.Architecture, "disassemble"):
+        raise BackendUnavailable("Architecture.disassemble needs gdb 7.6.")
+
+    try:
+        frame = gdb.selected_frame()
+        memory = gxf.get_memory()
+    except (gdb.error, ValueError) as e:
+        raise BackendUnavailable(e)
+
+    return frame, frame.architecture(), memory
+
+
+def _symbolize(memory, addr):
+    """
+    Returns (name, offset) from our own index or else from gdb, which
+    also knows about separate debug info, [vdso] or JIT code.
+    """
+
+    symbol = memory.symbolize(addr)
+    if symbol is not None:
+        return symbol
+
+    if hasattr(gdb, "format_address"):
+        m = re.search(r" <(.+?)(?:\+(\d+))?>(?: |$)",
+                      gdb.format_address(addr))
+    else:
+        try:
+            m = re.match(r"(.+?)(?: \+ (\d+))? in section ",
+                         gxf.execute("info symbol %#x" % addr))
+        except gdb.error:
+            m = None
+
+    if m is None:
+        return None
+    return m.group(1), int(m.group(2) or 0)
+
+
+def _function_range(addr):
+    """
+    Returns (name, start, end) of the function containing addr, from
+    gdb's blocks or else from the sized symbols of our own index.
+    """
+
+    try:
+        block = gdb.block_for_pc(addr)
+    except RuntimeError:
+        block = None
+
+    # Inlined functions have their own blocks, we want the outermost
+    # one whose superblock is the static block.
+    while block is not None and block.superblock is not None and \
+            not block.superblock.is_static:
+        block = block.superblock
+    if block is not None and block.function is not None:
+        return block.function.print_name, block.start, block.end
+
+    found = gxf.get_memory().symbolrange(addr)
+    if found is None:
+        raise NoFunctionError("No function contains specified address.")
+    return found
+
+
+class Function(object):
+    """
+    A function's boundaries and, once something needed them, the start
+    of each of its instructions. Those are only valid for the bytes
+    they were decoded from, which we keep to check them on each use.
+    """
+
+    __slots__ = ("name", "start", "end", "key", "data", "starts")
+
+    def __init__(self, name, start, end):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.key = None
+        self.data = None
+        self.starts = None
+
+    def instructions(self, arch, memory):
+        """
+        Returns (starts, data) for the function's current bytes.
+        """
+
+        data, _ = _read_code(memory, self.start, self.end, False)
+        key = arch.name(), len(data)
+
+        if key != self.key or data != self.data:
+            self.starts = array.array("Q", (addr for addr, _ in _decode(
+                arch, self.start, self.end, data, self.start)))
+            self.key, self.data = key, data
+
+        return self.starts, self.data
+
+
+class FunctionIndex(object):
+    """
+    Functions we already looked up, sorted by start address. Boundaries
+    come from the objfiles so the index is dropped when they change.
+    """
+
+    def __init__(self):
+        self.generation = None
+        self.starts = []
+        self.functions = []
+
+    def find(self, addr):
+
+        if self.generation != gxf.events.objfilegen.value:
+            self.generation = gxf.events.objfilegen.value
+            self.starts, self.functions = [], []
+
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr < self.functions[i].end:
+            return self.functions[i]
+
+        function = Function(*_function_range(addr))
+        i = bisect.bisect_right(self.starts, function.start)
+        self.starts.insert(i, function.start)
+        self.functions.insert(i, function)
+        return function
+
+
+functionindex = FunctionIndex()
+
+
+def _read_code(memory, startaddr, endaddr, ignmemerr):
+    """
+    Returns the bytes from startaddr to endaddr and the end we could
+    actually read up to. Instructions may go over the end, 16 bytes
+    is the longest one.
+    """
+
+    try:
+        data = memory.read(startaddr, endaddr - startaddr + 16)
+    except gxf.MemoryError as e:
+        if not ignmemerr and e.address < endaddr:
+            raise
+        try:
+            data = memory.read(startaddr, e.address - startaddr)
+        except gxf.MemoryError:
+            data = b""
+        endaddr = min(endaddr, startaddr + len(data))
+
+    return data, endaddr
+
+
+def _decode(arch, startaddr, endaddr, data, base):
+    """
+    Yields (addr, entry) for the instructions from startaddr to endaddr
+    in data, which starts at base. Entries come from the cache.
+    """
+
+    name = arch.name()
+    flavor = disassemblyflavor.value
+
+    addr = startaddr
+    while addr < endaddr:
+
+        offset = addr - base
+        entry = disassemblycache.get(name, flavor, addr, data, offset)
+
+        if entry is None:
+            # Whatever follows is probably missing too.
+            try:
+                disassemblycache.decode(
+                    arch, flavor, addr, endaddr, data, base)
+            except gxf.MemoryError:
+                # The last one goes over what we could read.
+                if addr == startaddr:
+                    raise
+                return
+            entry = disassemblycache.get(name, flavor, addr, data, offset)
+            if entry is None:
+                return
+
+        yield addr, entry
+        addr += len(entry[0])
+
+
+def _disassemble_structured(startaddr, endaddr=None, ignmemerr=False):
+
+    frame, arch, memory = _target()
+
+    startaddr = int(startaddr)
+    function = None
+
+    if endaddr is None:
+        found = functionindex.find(startaddr)
+        function, startaddr, endaddr = found.name, found.start, found.end
+    endaddr = int(endaddr)
+
+    if function is not None:
+        msg = "Dump of assembler code for function %s:" % function
+    else:
+        msg = "Dump of assembler code from %#x to %#x:" % (startaddr, endaddr)
+
+    if endaddr <= startaddr:
+        return [], msg
+
+    data, endaddr = _read_code(memory, startaddr, endaddr, ignmemerr)
+
+    if endaddr <= startaddr:
+        return [], msg
+
+    disassemblycache.load(memory, startaddr)
+
+    pc = frame.pc()
+    lines = []
+
+    for addr, entry in _decode(arch, startaddr, endaddr, data, startaddr):
+
+        if function is not None:
+            location = function, addr - startaddr
+        else:
+            location = _symbolize(memory, addr)
+
+        lines.append(DisassemblyLine(
+            address=addr, asm=entry[1], current=addr == pc,
+            bytecode=entry[0], location=location, entry=entry))
+
+    return lines, msg
+
+
+def _disassemble_window(addr, count, offset):
+    """
+    Returns the count lines starting offset instructions away from the
+    one containing addr, without leaving its function. Only those are
+    decoded once the function's instruction starts are known.
+    """
+
+    frame, arch, memory = _target()
+
+    function = functionindex.find(addr)
+    msg = "Dump of assembler code for function %s:" % function.name
+
+    disassemblycache.load(memory, function.start)
+    starts, data = function.instructions(arch, memory)
+
+    i = bisect.bisect_right(starts, addr) - 1
+    if i < 0:
+        raise BackendUnavailable("Can't decode the start of %s." % (
+            function.name))
+
+    first = max(i + offset, 0)
+    last = min(i + offset + count, len(starts))
+    if first >= last:
+        return DisassemblyBlock([], msg=msg)
+
+    endaddr = starts[last] if last < len(starts) else function.end
+
+    pc = frame.pc()
+    lines = []
+
+    for a, entry in _decode(arch, starts[first], endaddr, data,
+                            function.start):
+        lines.append(DisassemblyLine(
+            address=a, asm=entry[1], current=a == pc, bytecode=entry[0],
+            location=(function.name, a - function.start), entry=entry))
+
+    return DisassemblyBlock(lines, msg=msg)
+
+
+def _walk(arch, startaddr, addr, data, base):
+    """
+    Returns the (addr, entry) of the instructions from startaddr up to
+    addr and the index of the last (bad) one, or (None, None) if they
+    don't get exactly to addr. Misses are decoded a few bytes at a time
+    since most candidates quickly sync with what is already cached.
+    """
+
+    name = arch.name()
+    flavor = disassemblyflavor.value
+
+    insns = []
+    lastbad = None
+
+    a = startaddr
+    while a < addr:
+
+        entry = disassemblycache.get(name, flavor, a, data, a - base)
+        if entry is None:
+            try:
+                disassemblycache.decode(
+                    arch, flavor, a, min(addr, a + 32), data, base)
+            except gxf.MemoryError:
+                return None, None
+            entry = disassemblycache.get(name, flavor, a, data, a - base)
+            if entry is None:
+                return None, None
+
+        if "(bad)" in entry[1]:
+            lastbad = len(insns)
+
+        insns.append((a, entry))
+        a += len(entry[0])
+
+    if a != addr:
+        return None, None
+    return insns, lastbad
+
+
+def _sync(arch, addr, offset, data, base):
+    """
+    Returns the instructions before addr, from the start that syncs to
+    it. This makes the same choices as the text backend's backward hack
+    and remembers them, as long as they still lead to addr.
+    """
+
+    key = arch.name(), addr
+
+    # Searching further back might find a longer stream, not otherwise.
+    synced = disassemblycache.syncs.get(key)
+    if synced is not None and synced[0] >= base:
+        insns, _ = _walk(arch, synced[0], addr, data, base)
+        if insns is not None:
+            if synced[1] <= offset or len(insns) >= -offset:
+                return insns
+
+    found, best = None, None
+
+    # Any of 16 bytes should give a stream that synced 64 bytes later.
+    for startaddr in range(base, min(base + 16, addr)):
+        insns, lastbad = _walk(arch, startaddr, addr, data, base)
+        if insns is None:
+            continue
+        if lastbad is None:
+            found = insns
+            break
+        if best is None or lastbad < best:
+            found, best = insns, lastbad
+
+    if found is None:
+        # The target itself is probably misaligned, go back from it
+        # and take the furthest start that still gets there, addr
+        # itself always does.
+        bads = 0
+        for startaddr in range(addr, max(base, addr + offset * 16) - 1, -1):
+            insns, _ = _walk(arch, startaddr, addr, data, base)
+            if insns is not None:
+                found = insns
+                bads = 0
+            elif bads == 15:
+                break
+            else:
+                bads += 1
+
+    disassemblycache.syncs[key] = found[0][0] if found else addr, offset
+    return found
+
+
+def _disassemble_backward(addr, count, offset):
+    """
+    Returns count lines starting offset < 0 instructions before addr.
+    The preceding bytes are read once and candidate starts are decoded
+    locally instead of asking gdb to disassemble each of them.
+    """
+
+    frame, arch, memory = _target()
+
+    # 64 additional bytes gives it time to automagically sync.
+    startaddr = addr + offset * 16 - 64
+    endaddr = addr + max(count + offset, 0) * 16 + 16
+
+    try:
+        data = memory.read(startaddr, endaddr - startaddr)
+    except gxf.MemoryError:
+        # We're on the edge, start where addr's mapping does. If we
+        # don't know it the text backend has its ways of looking.
+        try:
+            startaddr = max(startaddr, memory.get_map(addr).start)
+        except gxf.MemoryError:
+            raise BackendUnavailable("No mapping contains %#x." % addr)
+        data, endaddr = _read_code(memory, startaddr, endaddr, True)
+
+    disassemblycache.load(memory, addr)
+    before = _sync(arch, addr, offset, data, startaddr)
+
+    entries = before[max(len(before) + offset, 0):]
+    entries += itertools.islice(
+        _decode(arch, addr, endaddr, data, startaddr), max(count + offset, 0))
+    entries = entries[:count]
+
+    pc = frame.pc()
+    lines = [DisassemblyLine(
+        address=a, asm=entry[1], current=a == pc, bytecode=entry[0],
+        location=_symbolize(memory, a), entry=entry)
+        for a, entry in entries]
+
+    msg = "Dump of assembler code from %#x to %#x:" % (startaddr, endaddr)
+    return DisassemblyBlock(lines, msg=msg)
+
+
 # _disassemble is a direct wrapper for gdb's disassemble.
 
 def _disassemble(startaddr, endaddr=None, hexdump=True, ignmemerr=False):
-    # TODO: We might want to use Architecture.disassemble
-    # problems with that:
-    #   - not sure how to get hexdump
-    #   - we can't limit on function bounds as we do now.
 
     modifier = " /r" if hexdump else ""
     what = ",".join(hex(int(addr)) for addr in (startaddr, endaddr) if addr)
@@ -574,7 +1775,19 @@ def _disassemble(startaddr, endaddr=None, hexdump=True, ignmemerr=False):
     return data[start:end], data[:start - 1]
 
 
-def disassemble(startaddr, endaddr=None, ignmemerr=False):
+def disassemble(startaddr, endaddr=None, ignmemerr=False, backend=None):
+
+    if (backend or dfltbackend) == "structured":
+        try:
+            lines, msg = _disassemble_structured(
+                startaddr, endaddr, ignmemerr)
+        except (BackendUnavailable, NoFunctionError):
+            # Not running, an old gdb or a function only gdb knows
+            # about. The text backend also says what's wrong.
+            pass
+        else:
+            return DisassemblyBlock(lines, msg=msg)
+
     data, msg = _disassemble(startaddr, endaddr, True, ignmemerr)
     return DisassemblyBlock(data, msg=msg)
 
@@ -602,6 +1815,14 @@ def _check_data(data, addr):
 def disassemble_lines(addr, count=1, offset=0, ignfct=False):
     addr = int(addr)
 
+    if ignfct is False and dfltbackend == "structured":
+
+        try:
+            return _disassemble_window(addr, count, offset)
+        except (BackendUnavailable, NoFunctionError):
+            # Same as disassemble, the text backend will tell.
+            pass
+
     if ignfct is False:
 
         try:
@@ -628,6 +1849,13 @@ def disassemble_lines(addr, count=1, offset=0, ignfct=False):
                                ignmemerr=True)
         return disafter[offset:offset + count]
 
+    if dfltbackend == "structured":
+
+        try:
+            return _disassemble_backward(addr, count, offset)
+        except BackendUnavailable:
+            pass
+
     # Now we need to use backwards disassembling hacks :-)
 
     # 64 additional bytes gives it time to automagically sync:
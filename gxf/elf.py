@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import mmap
+import array
+import bisect
+import struct
+import inspect
+import binascii
+import functools
+import collections
+
+# This module doesn't need gdb, everything is decoded straight from
+# the file which is mmaped. Nothing is parsed before it's asked for.
+
+ET_EXEC, ET_DYN = 2, 3
+
+SHT_SYMTAB, SHT_STRTAB, SHT_RELA, SHT_DYNSYM, SHT_REL = 2, 3, 4, 11, 9
+SHF_WRITE, SHF_ALLOC, SHF_EXECINSTR = 0x1, 0x2, 0x4
+
+PT_LOAD, PT_DYNAMIC, PT_INTERP, PT_NOTE = 1, 2, 3, 4
+PT_GNU_STACK, PT_GNU_RELRO = 0x6474e551, 0x6474e552
+PF_X, PF_W, PF_R = 0x1, 0x2, 0x4
+
+DT_NULL, DT_NEEDED, DT_STRTAB, DT_RPATH, DT_RUNPATH = 0, 1, 5, 15, 29
+DT_BIND_NOW, DT_FLAGS, DT_FLAGS_1 = 24, 30, 0x6ffffffb
+DF_BIND_NOW, DF_1_NOW, DF_1_PIE = 0x8, 0x1, 0x08000000
+
+STT_OBJECT, STT_FUNC, STT_GNU_IFUNC = 1, 2, 10
+
+NT_GNU_BUILD_ID = 3
+
+
+ElfHeader = collections.namedtuple("ElfHeader", (
+    "ident type machine version entry phoff shoff flags "
+    "ehsize phentsize phnum shentsize shnum shstrndx"))
+
+ElfSection = collections.namedtuple("ElfSection", (
+    "name type flags addr offset size link info addralign entsize"))
+
+ElfSegment = collections.namedtuple("ElfSegment", (
+    "type flags offset vaddr paddr filesz memsz align"))
+
+ElfSymbol = collections.namedtuple("ElfSymbol", (
+    "name value size type bind other shndx"))
+
+ElfReloc = collections.namedtuple("ElfReloc", (
+    "offset type sym addend"))
+
+
+class lazy(object):
+    """
+    Computes an attribute the first time it's used and keeps it.
+    """
+
+    def __init__(self, fct):
+        self.fct = fct
+        self.__doc__ = fct.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.fct.__name__] = self.fct(obj)
+        return value
+
+
+def malformed(fct):
+    """
+    Turns what truncated or corrupt files make us raise while parsing
+    into a ValueError, as for files which aren't ELF at all.
+    """
+
+    errors = (struct.error, KeyError, IndexError)
+
+    if inspect.isgeneratorfunction(fct):
+        @functools.wraps(fct)
+        def wrapper(self, *args, **kwargs):
+            try:
+                yield from fct(self, *args, **kwargs)
+            except errors as e:
+                raise ValueError("%s is malformed: %r" % (self.path, e))
+    else:
+        @functools.wraps(fct)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return fct(self, *args, **kwargs)
+            except errors as e:
+                raise ValueError("%s is malformed: %r" % (self.path, e))
+
+    return wrapper
+
+
+class ELF(object):
+
+    # Formats for (32 bits, 64 bits).
+    fmts = {
+        "header": ("16sHHIIIIIHHHHHH", "16sHHIQQQIHHHHHH"),
+        "section": ("IIIIIIIIII", "IIQQQQIIQQ"),
+        "segment": ("IIIIIIII", "IIQQQQQQ"),
+        "symbol": ("IIIBBH", "IBBHQQ"),
+        "dyn": ("iI", "qQ"),
+        "rel": ("II", "QQ"),
+        "rela": ("IIi", "QQq"),
+        }
+
+    @malformed
+    def __init__(self, path):
+
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:4] != b"\x7fELF":
+            raise ValueError("%s is not an ELF file." % path)
+
+        self.bits = {1: 32, 2: 64}[self.map[4]]
+        self.byteorder = {1: "little", 2: "big"}[self.map[5]]
+
+        self.endian = "<" if self.byteorder == "little" else ">"
+        self.structs = dict(
+            (k, struct.Struct(self.endian + v[self.bits == 64]))
+            for k, v in self.fmts.items())
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _table(self, kind, offset, count):
+        s = self.structs[kind]
+        return s.iter_unpack(
+            memoryview(self.map)[offset:offset + s.size * count])
+
+    def cstring(self, offset):
+        end = self.map.find(b"\x00", offset)
+        return self.map[offset:end].decode("utf8", "replace")
+
+    @lazy
+    @malformed
+    def header(self):
+        return ElfHeader(*self.structs["header"].unpack_from(self.map))
+
+    @lazy
+    @malformed
+    def sections(self):
+
+        h = self.header
+        if not h.shoff:
+            return []
+
+        raw = list(self._table("section", h.shoff, h.shnum))
+        names = raw[h.shstrndx][4] if h.shstrndx < len(raw) else None
+
+        return [ElfSection(self.cstring(names + s[0]) if names else "",
+                           *s[1:]) for s in raw]
+
+    @lazy
+    @malformed
+    def segments(self):
+
+        h = self.header
+        segments = self._table("segment", h.phoff, h.phnum)
+
+        if self.bits == 64:
+            return [ElfSegment(*s) for s in segments]
+
+        # 32 bits has flags near the end.
+        return [ElfSegment(t, fl, o, v, p, fs, ms, a)
+                for t, o, v, p, fs, ms, fl, a in segments]
+
+    def section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def segment(self, type):
+        for segment in self.segments:
+            if segment.type == type:
+                return segment
+        return None
+
+    def data(self, section):
+        """
+        Returns the content of a section or segment, without copying.
+        """
+        if isinstance(section, ElfSegment):
+            return memoryview(self.map)[
+                section.offset:section.offset + section.filesz]
+        return memoryview(self.map)[
+            section.offset:section.offset + section.size]
+
+    def vaddr_to_offset(self, vaddr):
+        for segment in self.segments:
+            if segment.type == PT_LOAD and \
+               segment.vaddr <= vaddr < segment.vaddr + segment.filesz:
+                return vaddr - segment.vaddr + segment.offset
+        return None
+
+    @lazy
+    @malformed
+    def dynamic(self):
+        """
+        List of (tag, value) from the PT_DYNAMIC segment.
+        """
+
+        segment = self.segment(PT_DYNAMIC)
+        if segment is None:
+            return []
+
+        entries = []
+        count = segment.filesz // self.structs["dyn"].size
+        for tag, value in self._table("dyn", segment.offset, count):
+            if tag == DT_NULL:
+                break
+            entries.append((tag, value))
+
+        return entries
+
+    def dynvalues(self, tag):
+        return [v for t, v in self.dynamic if t == tag]
+
+    def dynstrings(self, tag):
+        strtab = self.dynvalues(DT_STRTAB)
+        if not strtab:
+            return []
+        base = self.vaddr_to_offset(strtab[0])
+        if base is None:
+            return []
+        return [self.cstring(base + v) for v in self.dynvalues(tag)]
+
+    @malformed
+    def symbols(self, section):
+        """
+        Yields the symbols of a SHT_SYMTAB or SHT_DYNSYM section.
+        """
+
+        if isinstance(section, str):
+            section = self.section(section)
+        if section is None:
+            return
+
+        strtab = self.sections[section.link].offset
+        count = section.size // self.structs["symbol"].size
+
+        for s in self._table("symbol", section.offset, count):
+            if self.bits == 64:
+                name, info, other, shndx, value, size = s
+            else:
+                name, value, size, info, other, shndx = s
+            yield ElfSymbol(self.cstring(strtab + name), value, size,
+                            info & 0xf, info >> 4, other, shndx)
+
+    @malformed
+    def relocations(self, section):
+        """
+        Yields the relocations of a SHT_REL or SHT_RELA section.
+        """
+
+        if isinstance(section, str):
+            section = self.section(section)
+        if section is None:
+            return
+
+        kind = "rela" if section.type == SHT_RELA else "rel"
+        shift, mask = (32, 0xffffffff) if self.bits == 64 else (8, 0xff)
+        count = section.size // self.structs[kind].size
+
+        for r in self._table(kind, section.offset, count):
+            yield ElfReloc(r[0], r[1] & mask, r[1] >> shift,
+                           r[2] if len(r) > 2 else 0)
+
+    @malformed
+    def plt(self):
+        """
+        Yields (addr, size, name) for each PLT entry, named after the
+        symbol of its relocation. This works for stripped binaries.
+        """
+
+        relocs = self.section(".rela.plt") or self.section(".rel.plt")
+        plt = self.section(".plt.sec") or self.section(".plt")
+        if relocs is None or plt is None:
+            return
+
+        names = [s.name for s in self.symbols(self.sections[relocs.link])]
+        relocs = list(self.relocations(relocs))
+        if not relocs:
+            return
+
+        # .plt starts with an extra entry to call the resolver.
+        first = 0 if plt.name == ".plt.sec" else 1
+        size = plt.size // (len(relocs) + first)
+
+        for i, reloc in enumerate(relocs):
+            if reloc.sym < len(names) and names[reloc.sym]:
+                yield (plt.addr + (first + i) * size, size,
+                       "%s@plt" % names[reloc.sym])
+
+    @lazy
+    @malformed
+    def build_id(self):
+        """
+        The GNU build-id as an hex string or None.
+        """
+
+        notes = [s for s in self.sections if s.name.startswith(".note")]
+        notes = notes or [s for s in self.segments if s.type == PT_NOTE]
+
+        for note in notes:
+            data = self.data(note)
+            i = 0
+            while i + 12 <= len(data):
+                namesz, descsz, type = struct.unpack_from(
+                    self.endian + "III", data, i)
+                name = i + 12
+                desc = name + (namesz + 3) // 4 * 4
+                if type == NT_GNU_BUILD_ID and \
+                   data[name:name + namesz] == b"GNU\x00":
+                    return binascii.hexlify(
+                        data[desc:desc + descsz]).decode("ascii")
+                i = desc + (descsz + 3) // 4 * 4
+
+        return None
+
+    def checksec(self):
+        """
+        Returns an OrderedDict describing the usual mitigations.
+        """
+
+        flags = sum(self.dynvalues(DT_FLAGS))
+        flags1 = sum(self.dynvalues(DT_FLAGS_1))
+
+        if self.segment(PT_GNU_RELRO) is None:
+            relro = "No RELRO"
+        elif self.dynvalues(DT_BIND_NOW) or flags & DF_BIND_NOW or \
+                flags1 & DF_1_NOW:
+            relro = "Full RELRO"
+        else:
+            relro = "Partial RELRO"
+
+        stack = self.segment(PT_GNU_STACK)
+        nx = stack is not None and not stack.flags & PF_X
+
+        if self.header.type == ET_EXEC:
+            pie = "No PIE"
+        elif self.segment(PT_INTERP) is not None or flags1 & DF_1_PIE:
+            pie = "PIE"
+        elif self.header.type == ET_DYN:
+            pie = "DSO"
+        else:
+            pie = "Not an executable"
+
+        # The dynamic symbols are enough unless this is static.
+        symtab = self.section(".dynsym") or self.section(".symtab")
+        names = set(s.name for s in self.symbols(symtab))
+
+        canary = bool(names & {"__stack_chk_fail", "__stack_chk_guard",
+                               "__intel_security_cookie"})
+        fortify = sorted(n for n in names
+                         if n.startswith("__") and n.endswith("_chk")
+                         if n != "__stack_chk_fail")
+
+        return collections.OrderedDict((
+            ("RELRO", relro),
+            ("Stack canary", canary),
+            ("NX", nx),
+            ("PIE", pie),
+            ("RPATH", ":".join(self.dynstrings(DT_RPATH)) or None),
+            ("RUNPATH", ":".join(self.dynstrings(DT_RUNPATH)) or None),
+            ("FORTIFY", len(fortify)),
+            ))
+
+
+class SymbolIndex(object):
+    """
+    Sorted starts of the symbols of an ELF file, including dynamic ones
+    and PLT entries, for bisect lookups. Addresses are the file's own,
+    base is what must be added once it's loaded.
+    """
+
+    kinds = (STT_OBJECT, STT_FUNC, STT_GNU_IFUNC)
+
+    def __init__(self, elf):
+
+        symbols = {}
+
+        for table in (".dynsym", ".symtab"):
+            for s in elf.symbols(table):
+                if s.value and s.name and s.shndx and s.type in self.kinds:
+                    symbols.setdefault(s.value, (s.size, s.name))
+
+        for addr, size, name in elf.plt():
+            symbols.setdefault(addr, (size, name))
+
+        self.starts = array.array("Q", sorted(symbols))
+        self.sizes = [symbols[a][0] for a in self.starts]
+        self.names = [symbols[a][1] for a in self.starts]
+
+        loads = [s.vaddr for s in elf.segments if s.type == PT_LOAD]
+        self.minvaddr = min(loads) & ~0xfff if loads else 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def find(self, addr):
+        """
+        Returns the position of the symbol containing addr or None.
+        Symbols without a size only match their exact address.
+        """
+
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i < 0 or addr - self.starts[i] >= max(self.sizes[i], 1):
+            return None
+        return i
+
+    def lookup(self, addr):
+        """
+        Returns (name, offset) of the symbol containing addr or None.
+        """
+
+        i = self.find(addr)
+        if i is None:
+            return None
+        return self.names[i], addr - self.starts[i]
+
+    def range(self, addr):
+        """
+        Returns (name, start, end) of the sized symbol containing addr
+        or None.
+        """
+
+        i = self.find(addr)
+        if i is None or not self.sizes[i]:
+            return None
+        return self.names[i], self.starts[i], self.starts[i] + self.sizes[i]
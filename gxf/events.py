@@ -10,6 +10,31 @@ cont = gdb.events.cont
 stop = gdb.events.stop
 exited = gdb.events.exited
 new_objfile = gdb.events.new_objfile
+memory_changed = gdb.events.memory_changed
+clear_objfiles = gdb.events.clear_objfiles
+
+# Only gdb >= 12 tells us when it's exiting.
+exiting = getattr(gdb.events, "gdb_exiting", None)
+
+
+class Generation(object):
+    """
+    Counts how many times any of the given events occured. Caches
+    remember the value they were built at to know when they are stale.
+    """
+
+    def __init__(self, *registries):
+        self.value = 0
+        for registry in registries:
+            registry.connect(self.bump)
+
+    def bump(self, *args, **kwargs):
+        self.value += 1
+
+
+stopgen = Generation(cont, exited, new_objfile)
+memgen = Generation(cont, exited, new_objfile, memory_changed)
+objfilegen = Generation(new_objfile, clear_objfiles)
 
 
 class HookEvent(object):
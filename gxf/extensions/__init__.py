@@ -20,10 +20,16 @@ class Gx(gxf.Command):
 with gxf.register.prefix("gx"):
     import gxf.extensions.reload        # NOQA
     import gxf.extensions.meta          # NOQA
+    import gxf.extensions.benchmark     # NOQA
     import gxf.extensions.testi         # NOQA
     import gxf.extensions.binexpect     # NOQA
 
     import gxf.extensions.telescope     # NOQA
+    import gxf.extensions.search        # NOQA
+    import gxf.extensions.xrefmem       # NOQA
+    import gxf.extensions.strings       # NOQA
+    import gxf.extensions.snapshot      # NOQA
+    import gxf.extensions.fuzz          # NOQA
     import gxf.extensions.addr          # NOQA
     import gxf.extensions.vmaps         # NOQA
     import gxf.extensions.disassemble   # NOQA
@@ -32,3 +38,4 @@ with gxf.register.prefix("gx"):
     import gxf.extensions.context       # NOQA
     import gxf.extensions.registers     # NOQA
     import gxf.extensions.cyclic        # NOQA
+    import gxf.extensions.elf           # NOQA
@@ -14,7 +14,7 @@ class Addr(gxf.DataCommand):
 
     def run(self, args):
 
-        memory = gxf.Memory()
+        memory = gxf.get_memory()
 
         refchain = memory.refchain(args.what)
 
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import time
+import tracemalloc
+
+import tabulate
+
+import gxf
+
+
+def bench(fct, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fct()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+@gxf.register(prefix=True)
+class Benchmark(gxf.MaintenanceCommand):
+    '''
+    This command is used as a prefix for gxf's benchmarks.
+    '''
+
+    def run(self, args):
+        pass
+
+
+@gxf.register("memory", parent="benchmark")
+class BenchmarkMemory(gxf.MaintenanceCommand):
+    '''
+    Compares the available memory backends on telescope and string reads.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("what", type=gxf.LocationType(),
+                            nargs="?", default="$sp")
+        parser.add_argument("-c", "--count", type=int, default=4096,
+                            help="number of pointers or strings to read.")
+        parser.add_argument("-l", "--strlen", type=int, default=4096,
+                            help="maximum length of a string read.")
+        parser.add_argument("-r", "--repeat", type=int, default=3)
+
+    def run(self, args):
+
+        inferior = gxf.inferiors.get_selected_inferior()
+        memory = gxf.get_memory(inferior)
+
+        addr = int(args.what)
+        end = memory.get_map(addr).end
+        size = memory.ptrsize
+        count = max(1, min(args.count, (end - addr) // size))
+        addrs = range(addr, addr + count * size, size)
+
+        print("Reading %d pointers and strings at %#x.\n" % (count, addr))
+
+        selected = memory.cache.backend.name
+        headers = ["backend", "telescope", "bulk", "strings"]
+        tbldata = []
+
+        for backend in gxf.memory.backends:
+
+            if not backend.available(inferior):
+                tbldata.append([backend.name] + ["n/a"] * 3)
+                continue
+
+            backend = backend(inferior)
+
+            try:
+                telescope = bench(lambda: [
+                    backend.read(a, size) for a in addrs], args.repeat)
+                bulk = bench(lambda: backend.read(addr, count * size),
+                             args.repeat)
+                strings = bench(lambda: [
+                    backend.read(a, min(args.strlen, end - a))
+                    for a in addrs], args.repeat)
+            finally:
+                backend.close()
+
+            name = backend.name
+            if name == selected:
+                name += " (selected)"
+
+            tbldata.append([name] + ["%.2fms" % (t * 1000)
+                                     for t in (telescope, bulk, strings)])
+
+        print(tabulate.tabulate(tbldata, headers=headers))
+
+
+class DictMMap(object):
+    """
+    What an MMap looked like before it had __slots__.
+    """
+
+    def __init__(self, start, end, perms, backing=None):
+        self.start = start
+        self.end = end
+        self.perms = perms
+        self.backing = backing
+        self.comment = None
+        self.base = None
+
+
+def allocations(fct):
+    """
+    Returns the time, traced memory and gc collections it takes to
+    build what fct returns, which is kept alive until we measured.
+    """
+
+    gc.collect()
+    collections = sum(s["collections"] for s in gc.get_stats())
+
+    tracemalloc.start()
+    start = time.time()
+    try:
+        kept = fct()
+        elapsed = time.time() - start
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    collections = sum(s["collections"] for s in gc.get_stats()) - collections
+    del kept
+    return elapsed, size, collections
+
+
+@gxf.register("alloc", parent="benchmark")
+class BenchmarkAlloc(gxf.MaintenanceCommand):
+    '''
+    Compares the allocations of mappings and chain links with and
+    without __slots__, for as many objects as a big vmaps or telescope.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("-c", "--count", type=int, default=100000,
+                            help="number of objects to build.")
+
+    def run(self, args):
+
+        count = args.count
+        Link = gxf.memory.Link
+
+        tests = [
+            ("mmap", "dict", lambda: [
+                DictMMap(i, i + 4096, "rw-p", "[heap]")
+                for i in range(count)]),
+            ("mmap", "slots", lambda: [
+                gxf.MMap(i, i + 4096, "rw-p", "[heap]")
+                for i in range(count)]),
+            ("link", "list", lambda: [
+                [i, None, i, i] for i in range(count)]),
+            ("link", "slots", lambda: [
+                Link(i, None, i, i) for i in range(count)]),
+            ]
+
+        headers = ["what", "layout", "time", "memory", "gc collections"]
+        tbldata = []
+
+        for what, layout, fct in tests:
+            elapsed, size, collections = allocations(fct)
+            tbldata.append([what, layout, "%.2fms" % (elapsed * 1000),
+                            "%.1fKiB" % (size / 1024), collections])
+
+        print("Building %d objects of each.\n" % count)
+        print(tabulate.tabulate(tbldata, headers=headers))
+
+
+@gxf.register("disassembly", parent="benchmark")
+class BenchmarkDisassembly(gxf.MaintenanceCommand):
+    '''
+    Compares the disassembly backends on the function containing an
+    address and on a long range of instructions, with and without
+    rendering the result. The structured backend is measured with an
+    empty disassembly cache and with a warm one.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("what", type=gxf.LocationType(),
+                            nargs="?", default="$pc")
+        parser.add_argument("-c", "--count", type=int, default=10000,
+                            help="number of instructions in the range.")
+        parser.add_argument("-r", "--repeat", type=int, default=3)
+
+    def run(self, args):
+
+        addr = int(args.what)
+        end = gxf.get_memory().get_map(addr).end
+
+        # We don't know how long instructions are, assume 4 bytes.
+        ranges = [("function", addr, None),
+                  ("range", addr, min(end, addr + args.count * 4))]
+
+        headers = ["backend", "what", "lines", "decode", "decode+render"]
+        tbldata = []
+
+        # The benchmark empties the cache, it gets its entries back.
+        cache = gxf.disassembly.disassemblycache
+        entries = dict(cache.entries)
+
+        for backend, cached in (("text", False), ("structured", False),
+                                ("structured", True)):
+            name = "%s (cached)" % backend if cached else backend
+            for what, start, stop in ranges:
+
+                def decode():
+                    if not cached:
+                        cache.entries.clear()
+                    return gxf.disassembly.disassemble(
+                        start, stop, ignmemerr=True, backend=backend)
+
+                try:
+                    lines = len(decode())
+                except gxf.GdbError as e:
+                    tbldata.append([name, what, "n/a", "", str(e)])
+                    continue
+
+                tdecode = bench(decode, args.repeat)
+                trender = bench(lambda: decode().format(), args.repeat)
+
+                tbldata.append([name, what, lines,
+                                "%.2fms" % (tdecode * 1000),
+                                "%.2fms" % (trender * 1000)])
+
+        cache.entries.update(entries)
+        print(tabulate.tabulate(tbldata, headers=headers))
+
+
+@gxf.register("tokenizer", parent="benchmark")
+class BenchmarkTokenizer(gxf.MaintenanceCommand):
+    '''
+    Compares the tokenizer with the pygments lexer on gdb's disassembly
+    of a range of instructions: lines per second and lines for which
+    they don't give the same tokens, each line being lexed alone.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("what", type=gxf.LocationType(),
+                            nargs="?", default="$pc")
+        parser.add_argument("-c", "--count", type=int, default=5000,
+                            help="number of instructions in the range.")
+        parser.add_argument("-r", "--repeat", type=int, default=3)
+        parser.add_argument("-v", "--verbose", action="store_true",
+                            help="show the lines that differ.")
+
+    def run(self, args):
+
+        addr = int(args.what)
+        end = gxf.get_memory().get_map(addr).end
+
+        data, msg = gxf.disassembly._disassemble(
+            addr, min(end, addr + args.count * 4), True, True)
+        lines = data.splitlines()
+
+        if not lines:
+            exit("Nothing to disassemble.")
+
+        lexer = gxf.disassembly.lexer
+        tokenizer = gxf.disassembly.tokenizer
+
+        headers = ["lexer", "lines", "time", "lines/s"]
+        tbldata = []
+
+        for name, lex in (("pygments", lexer), ("tokenizer", None)):
+            elapsed = bench(lambda: gxf.disassembly.DisassemblyBlock(
+                data, lexer=lex, msg=msg), args.repeat)
+            tbldata.append([name, len(lines), "%.2fms" % (elapsed * 1000),
+                            "%.0f" % (len(lines) / max(elapsed, 1e-9))])
+
+        print(tabulate.tabulate(tbldata, headers=headers))
+
+        differ = 0
+        for text in lines:
+            expected = [line.tokens for line in
+                        gxf.disassembly.DisassemblyBlock(
+                            text, lexer=lexer, msg=msg)]
+            found = [line.tokens for line in
+                     gxf.disassembly.DisassemblyBlock(text, msg=msg)]
+            if expected != found:
+                differ += 1
+                if args.verbose:
+                    print("%s\n    pygments:  %s\n    tokenizer: %s" % (
+                        text, expected, found))
+
+        print("\n%d of %d lines differ (%s flavor)." % (
+            differ, len(lines), tokenizer.flavor))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import gdb
+import tabulate
+
+import gxf
+
+
+def get_elf(name):
+    """
+    Opens name, which can also be part of the filename of an objfile.
+    By default this is the main executable.
+    """
+
+    if name is None:
+        name = gdb.current_progspace().filename
+        if name is None:
+            exit("No executable, give a file.")
+
+    if not os.path.exists(name):
+        for objfile in gdb.objfiles():
+            if objfile.filename and name in objfile.filename:
+                name = objfile.filename
+                break
+        else:
+            exit("No file or objfile matching %s." % name)
+
+    try:
+        return gxf.ELF(name)
+    except (IOError, ValueError) as e:
+        exit(e)
+
+
+@gxf.register()
+class Checksec(gxf.FilesCommand):
+    '''
+    Shows which mitigations a binary was built with.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("file", nargs="?", type=gxf.FilePathType(),
+                            help="file or objfile to check, "
+                            "defaults to the executable.")
+
+    def run(self, args):
+
+        with get_elf(args.file) as elf:
+            print("%s:" % elf.path)
+            for what, value in elf.checksec().items():
+                print("    %-14s%s" % (what, value))
+
+
+@gxf.register()
+class Elf(gxf.FilesCommand):
+    '''
+    Shows the headers, segments and sections of an ELF file.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("file", nargs="?", type=gxf.FilePathType(),
+                            help="file or objfile to show, "
+                            "defaults to the executable.")
+        parser.add_argument("-s", "--sections", action="store_true",
+                            help="only show sections.")
+        parser.add_argument("-l", "--segments", action="store_true",
+                            help="only show segments.")
+
+    def run(self, args):
+
+        both = not args.sections and not args.segments
+
+        with get_elf(args.file) as elf:
+
+            h = elf.header
+
+            if both:
+                print("%s: %d bits %s endian, type %d, machine %d" % (
+                    elf.path, elf.bits, elf.byteorder, h.type, h.machine))
+                print("entry %#x, build-id %s\n" % (h.entry, elf.build_id))
+
+            if both or args.segments:
+                print(tabulate.tabulate([[
+                    "%#x" % s.type, "%#x" % s.offset, "%#x" % s.vaddr,
+                    "%#x" % s.filesz, "%#x" % s.memsz, "%s%s%s" % (
+                        "r" if s.flags & gxf.elf.PF_R else "-",
+                        "w" if s.flags & gxf.elf.PF_W else "-",
+                        "x" if s.flags & gxf.elf.PF_X else "-")]
+                    for s in elf.segments], headers=[
+                        "type", "offset", "vaddr", "filesz", "memsz",
+                        "flags"]))
+
+            if both:
+                print()
+
+            if both or args.sections:
+                print(tabulate.tabulate([[
+                    s.name, s.type, "%#x" % s.addr, "%#x" % s.offset,
+                    "%#x" % s.size, "%s%s%s" % (
+                        "a" if s.flags & gxf.elf.SHF_ALLOC else "-",
+                        "w" if s.flags & gxf.elf.SHF_WRITE else "-",
+                        "x" if s.flags & gxf.elf.SHF_EXECINSTR else "-")]
+                    for s in elf.sections], headers=[
+                        "name", "type", "addr", "offset", "size", "flags"]))
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import random
+import signal
+import hashlib
+import threading
+
+import gdb
+import gxf
+
+
+CRASHSIGNALS = ("SIGSEGV", "SIGBUS", "SIGILL", "SIGFPE", "SIGABRT", "SIGSYS")
+
+INTERESTING = (b"\x00", b"\xff", b"\x7f", b"\x80", b"\x00\x00\x00\x00",
+               b"\xff\xff\xff\xff", b"\xff\xff\xff\x7f", b"%n%s%p")
+
+
+def mutate(rng, data, maxcount=8):
+    """
+    Returns a copy of data with a few bit flips, random bytes,
+    interesting values and copied chunks, its size doesn't change.
+    """
+
+    data = bytearray(data)
+    if not data:
+        return data
+
+    for _ in range(rng.randint(1, maxcount)):
+
+        pos = rng.randrange(len(data))
+        what = rng.randrange(4)
+
+        if what == 0:
+            data[pos] ^= 1 << rng.randrange(8)
+        elif what == 1:
+            data[pos] = rng.randrange(256)
+        elif what == 2:
+            value = rng.choice(INTERESTING)[:len(data) - pos]
+            data[pos:pos + len(value)] = value
+        else:
+            src = rng.randrange(len(data))
+            size = rng.randint(1, min(32, len(data) - max(pos, src)))
+            data[pos:pos + size] = data[src:src + size]
+
+    return data
+
+
+def signature(depth=8):
+    """
+    Identifies a crash by its pc and a hash of the backtrace's pcs.
+    """
+
+    frame = gdb.newest_frame()
+    pc = frame.pc()
+
+    digest = hashlib.sha1()
+    while frame is not None and depth > 0:
+        digest.update(("%x," % frame.pc()).encode("ascii"))
+        frame, depth = frame.older(), depth - 1
+
+    return "%#x-%s" % (pc, digest.hexdigest()[:8])
+
+
+class StopRecorder(object):
+    """
+    Remembers the last stop or exit of the inferior.
+    """
+
+    def __init__(self):
+        self.event = None
+        gxf.events.stop.connect(self)
+        gxf.events.exited.connect(self)
+
+    def __call__(self, event):
+        self.event = event
+
+    def close(self):
+        gxf.events.stop.disconnect(self)
+        gxf.events.exited.disconnect(self)
+
+
+@gxf.register()
+class Fuzz(gxf.RunningCommand):
+    '''
+    Fuzzes the inferior in place: restores a snapshot, writes a mutated
+    input into memory, continues until a stop or the until address and
+    records the crashes by signature. This is a lot faster than
+    restarting the inferior for each input.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("snapshot", type=gxf.FilePathType(),
+                            help="snapshot to restore before each input, "
+                            "it should be taken at the breakpoint.")
+        parser.add_argument("what", type=gxf.LocationType(),
+                            help="where to write the inputs.")
+        parser.add_argument("size", type=int,
+                            help="size of the inputs.")
+        parser.add_argument("until", type=gxf.LocationType(),
+                            help="stop an execution at this address.")
+        parser.add_argument("-s", "--seed", action="append", default=[],
+                            type=gxf.FileType("rb"),
+                            help="initial inputs, defaults to the bytes "
+                            "found in memory.")
+        parser.add_argument("-n", "--count", type=int, default=None,
+                            help="stop after this many executions.")
+        parser.add_argument("-t", "--timeout", type=float, default=None,
+                            help="interrupt executions taking longer than "
+                            "this many seconds.")
+        parser.add_argument("-o", "--output", type=gxf.FilePathType(),
+                            default=None,
+                            help="save the first input of each crash "
+                            "to this directory.")
+        parser.add_argument("-r", "--random-seed", type=int, default=None)
+
+    def interrupt(self, pid):
+        self.timedout = True
+        os.kill(pid, signal.SIGINT)
+
+    def execute(self, pid, timeout):
+        """
+        Continues the inferior discarding any pending signal, and
+        returns the event it stopped with.
+        """
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self.interrupt, (pid,))
+            timer.start()
+
+        self.recorder.event = None
+        self.timedout = False
+
+        try:
+            gxf.execute("signal 0")
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        return self.recorder.event
+
+    def report(self, execs, crashes, hangs, elapsed):
+        print("%d execs, %.1f execs/s, %d crashes (%d unique), %d hangs." % (
+            execs, execs / max(elapsed, 1e-9),
+            sum(c for c, _ in crashes.values()), len(crashes), hangs))
+
+    def run(self, args):
+
+        snapshot = gxf.Snapshot(args.snapshot)
+        memory = gxf.get_memory()
+        pid = memory.inf.pid
+        addr, until = int(args.what), int(args.until)
+
+        rng = random.Random(args.random_seed)
+
+        snapshot.restore(memory)
+        snapshot.restore_registers()
+
+        seeds = []
+        for f in args.seed:
+            with f:
+                seeds.append(f.read()[:args.size].ljust(args.size, b"\x00"))
+        if not seeds:
+            seeds = [memory.read(addr, args.size, cache=False)]
+
+        if args.output is not None:
+            os.makedirs(args.output, exist_ok=True)
+
+        breakpoint = gdb.Breakpoint("*%#x" % until, internal=True)
+        self.recorder = StopRecorder()
+
+        crashes = {}
+        execs = hangs = 0
+        start = last = time.time()
+
+        try:
+            while args.count is None or execs < args.count:
+
+                if execs:
+                    snapshot.restore(memory)
+                    snapshot.restore_registers()
+
+                data = mutate(rng, rng.choice(seeds))
+                memory.write(addr, data)
+
+                event = self.execute(pid, args.timeout)
+                execs += 1
+
+                if isinstance(event, gdb.ExitedEvent) or event is None:
+                    print("The inferior exited, it can't be restored.")
+                    break
+
+                stopsig = getattr(event, "stop_signal", None)
+
+                if stopsig == "SIGINT":
+                    if not self.timedout:
+                        print("Interrupted.")
+                        break
+                    hangs += 1
+
+                elif stopsig in CRASHSIGNALS:
+                    sig = "%s-%s" % (stopsig, signature())
+                    if sig not in crashes:
+                        crashes[sig] = [0, data]
+                        print("New crash %s." % sig)
+                        if args.output is not None:
+                            with open(os.path.join(
+                                    args.output, sig), "wb") as f:
+                                f.write(data)
+                    crashes[sig][0] += 1
+
+                now = time.time()
+                if now - last >= 5:
+                    self.report(execs, crashes, hangs, now - start)
+                    last = now
+
+        except KeyboardInterrupt:
+            print("Interrupted.")
+
+        finally:
+            self.recorder.close()
+            breakpoint.delete()
+            snapshot.close()
+
+        self.report(execs, crashes, hangs, time.time() - start)
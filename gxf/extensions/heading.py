@@ -21,7 +21,7 @@ class Heading(gxf.DataCommand):
                 args.what, count=args.count + args.before, offset=-args.before)
         except gxf.MemoryError as e:
             if e.address == args.what:
-                memory = gxf.Memory()
+                memory = gxf.get_memory()
                 print("Invalid address %s." % memory.refchain(e.address).format())
                 return
             else:
@@ -28,3 +28,19 @@ class Meta(gxf.MaintenanceCommand):
 
         print("Garbage collector statistics:\n")
         print(tabulate.tabulate(tbldata, headers=headers))
+
+        headers = ["inferior", "backend", "pages",
+                   "hits", "misses", "flushes"]
+        tbldata = [[num, c._backend.name if c._backend else None,
+                    len(c.pages), c.hits, c.misses, c.flushes]
+                   for num, c in sorted(gxf.memory.pagecaches.items())]
+
+        print("\nPage cache statistics:\n")
+        print(tabulate.tabulate(tbldata, headers=headers))
+
+        headers = ["what", "count", "seconds"]
+        tbldata = [[what] + stats
+                   for what, stats in gxf.memory.memorystats.items()]
+
+        print("\nMemory snapshot statistics:\n")
+        print(tabulate.tabulate(tbldata, headers=headers))
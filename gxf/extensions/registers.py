@@ -20,7 +20,7 @@ class Registers(gxf.DataCommand):
     def run(self, args):
 
         regs = gxf.Registers()
-        memory = gxf.Memory()
+        memory = gxf.get_memory()
 
         tomark = args.mark[:]
 
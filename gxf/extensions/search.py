@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+import gxf
+
+from gxf.formatting import Token, Formattable
+
+
+@gxf.register()
+class Search(gxf.DataCommand):
+    '''
+    Searches memory for bytes, hex, integers or regular expressions.
+    When several patterns are given memory is read only once and the
+    results are grouped by pattern and mapping.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("pattern", nargs="*",
+                            help="what to search, python escapes are "
+                            "understood unless another kind is given.")
+        parser.add_argument("-f", "--file", type=gxf.FileType(),
+                            help="read more patterns from this file, "
+                            "one per line.")
+
+        kind = parser.add_mutually_exclusive_group()
+        kind.add_argument("-x", "--hex", dest="kind", action="store_const",
+                          const=gxf.memory.HEX, default=gxf.memory.BYTES)
+        kind.add_argument("-i", "--int", dest="kind", action="store_const",
+                          const=gxf.memory.INT)
+        kind.add_argument("-r", "--regex", dest="kind", action="store_const",
+                          const=gxf.memory.REGEX)
+
+        parser.add_argument("-w", "--width", type=int, default=None,
+                            help="size of integers, "
+                            "defaults to the size of a pointer.")
+        parser.add_argument("-a", "--aligned", action="store_true",
+                            help="only match integer sized patterns at "
+                            "aligned addresses, this is a lot faster for "
+                            "many of them.")
+        parser.add_argument("-p", "--perms", default="r",
+                            help="only search mappings with "
+                            "those permissions, defaults to r.")
+        parser.add_argument("-m", "--mapping", default=None,
+                            help="only search mappings with "
+                            "a backing containing this.")
+        parser.add_argument("-l", "--limit", type=int, default=None,
+                            help="stop after this many matches.")
+        parser.add_argument("-q", "--quiet", action="store_true",
+                            help="do not show progress.")
+
+    def progress(self, done, total):
+        print("\r%3d%% of %#x bytes" % (done * 100 // max(total, 1), total),
+              end="", flush=True)
+        self.dirty = True
+
+    def clear(self):
+        if self.dirty:
+            print("\r%s\r" % (" " * 40), end="")
+            self.dirty = False
+
+    def show(self, addr, mmap, match):
+        print("%s %s+%#x : %s" % (
+            Formattable(mmap.fmtaddr(addr)),
+            mmap.backing, addr - mmap.start,
+            Formattable(((Token.Comment, gxf.memory.repr_long_str(
+                match.decode("latin-1"), 32)),))))
+
+    def run(self, args):
+
+        memory = gxf.get_memory()
+
+        texts = args.pattern[:]
+        if args.file is not None:
+            texts.extend(t.rstrip("\n") for t in args.file if t.strip())
+        if not texts:
+            exit("No pattern to search for.")
+
+        patterns = gxf.memory.PatternSet((
+            gxf.memory.compile_pattern(
+                text, args.kind, args.width or memory.ptrsize,
+                memory.byteorder) for text in texts), aligned=args.aligned)
+
+        mmaps = [m for m in memory.mapindex
+                 if all(p in m.perms for p in args.perms)
+                 if args.mapping is None or args.mapping in (m.backing or "")]
+
+        self.dirty = False
+        progress = None if args.quiet or not args.isatty else self.progress
+
+        count = 0
+        grouped = collections.OrderedDict((p, collections.OrderedDict())
+                                          for p in patterns)
+
+        try:
+            for addr, mmap, pattern, match in memory.search(
+                    patterns, mmaps, progress=progress):
+
+                if len(patterns) == 1:
+                    self.clear()
+                    self.show(addr, mmap, match)
+                else:
+                    grouped[pattern].setdefault(mmap, []).append(
+                        (addr, match))
+
+                count += 1
+                if args.limit is not None and count >= args.limit:
+                    break
+
+        except KeyboardInterrupt:
+            self.clear()
+            print("Interrupted.")
+
+        self.clear()
+
+        if len(patterns) > 1:
+            for pattern, mmaps in grouped.items():
+                print("%s: %d matches." % (
+                    pattern.name, sum(len(m) for m in mmaps.values())))
+                for mmap, matches in mmaps.items():
+                    print("  %#x - %#x %s %s" % (
+                        mmap.start, mmap.end, mmap.perms, mmap.backing))
+                    for addr, match in sorted(matches):
+                        print("    ", end="")
+                        self.show(addr, mmap, match)
+
+        print("%d matches." % count)
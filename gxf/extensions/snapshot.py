@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import binascii
+
+import gxf
+
+from gxf.formatting import Formattable
+
+
+def hexlify(data, maxlen=16):
+    text = binascii.hexlify(data[:maxlen]).decode("ascii")
+    if len(data) > maxlen:
+        text += ".."
+    return text
+
+
+@gxf.register(prefix=True)
+class Snapshot(gxf.SupportCommand):
+    '''
+    This command is used as a prefix for saving, comparing and restoring
+    snapshots of the inferior's memory and registers.
+    '''
+
+    def run(self, args):
+        pass
+
+
+@gxf.register("save", parent="snapshot")
+class SnapshotSave(gxf.SupportCommand):
+    '''
+    Saves the inferior's readable memory and its registers to a file.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("name", type=gxf.FilePathType(),
+                            help="file to save the snapshot to.")
+        parser.add_argument("-p", "--perms", default="r",
+                            help="only save mappings with "
+                            "those permissions, defaults to r.")
+        parser.add_argument("-m", "--mapping", default=None,
+                            help="only save mappings with "
+                            "a backing containing this.")
+
+    def run(self, args):
+
+        memory = gxf.get_memory()
+
+        mmaps = [m for m in memory.mapindex
+                 if all(p in m.perms for p in args.perms)
+                 if args.mapping is None or args.mapping in (m.backing or "")]
+
+        start = time.time()
+        snapshot = gxf.Snapshot.save(args.name, memory, mmaps,
+                                     gxf.Registers().regs)
+        elapsed = time.time() - start
+
+        print("Saved %d pages of %d mappings to %s in %.2fs." % (
+            len(snapshot), len(snapshot.maps), args.name, elapsed))
+
+        snapshot.close()
+
+
+@gxf.register("restore", parent="snapshot")
+class SnapshotRestore(gxf.SupportCommand):
+    '''
+    Writes back the registers and the pages of a snapshot which differ
+    from the live inferior.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("name", type=gxf.FilePathType(),
+                            help="snapshot to restore.")
+        parser.add_argument("-n", "--no-registers", action="store_true",
+                            help="only restore memory.")
+
+    def run(self, args):
+
+        snapshot = gxf.Snapshot(args.name)
+        memory = gxf.get_memory()
+
+        if snapshot.meta["pid"] != memory.inf.pid:
+            print("Warning: this snapshot was taken from pid %d." % (
+                snapshot.meta["pid"]))
+
+        start = time.time()
+
+        try:
+            pages = snapshot.restore(memory)
+            failed = [] if args.no_registers else snapshot.restore_registers()
+        finally:
+            snapshot.close()
+
+        elapsed = time.time() - start
+
+        print("Restored %d pages in %.2fs." % (pages, elapsed))
+        if failed:
+            print("Could not restore %s." % ", ".join(failed))
+
+
+@gxf.register("diff", parent="snapshot")
+class SnapshotDiff(gxf.SupportCommand):
+    '''
+    Shows what changed between a snapshot and another one or the live
+    inferior. Only pages whose hashes differ are compared.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("old", type=gxf.FilePathType(),
+                            help="snapshot to compare.")
+        parser.add_argument("new", type=gxf.FilePathType(), nargs="?",
+                            help="snapshot to compare with, "
+                            "defaults to the live inferior.")
+        parser.add_argument("-w", "--width", type=int, default=16,
+                            help="show at most this many bytes per change.")
+        parser.add_argument("-l", "--limit", type=int, default=None,
+                            help="stop after this many changes.")
+
+    def run(self, args):
+
+        old = gxf.Snapshot(args.old)
+
+        if args.new is not None:
+            new = gxf.Snapshot(args.new)
+            mapindex = gxf.MMapIndex(new.maps + old.maps)
+            pages = new.pages()
+        else:
+            new = None
+            memory = gxf.get_memory()
+            mapindex = memory.mapindex
+            pages = gxf.livepages(memory, [
+                m for m in memory.mapindex if "r" in m.perms and any(
+                    o.start < m.end and m.start < o.end for o in old.maps)])
+
+        count = 0
+        diff = gxf.diffpages(old.pages(), pages)
+
+        try:
+            for addr, before, after in diff:
+
+                if before is None or after is None:
+                    print("%#x - %#x only in %s" % (
+                        addr, addr + old.pagesize,
+                        os.path.basename(old.path) if after is None else
+                        os.path.basename(new.path) if new else "live"))
+                else:
+                    mmap = mapindex.find(addr)
+                    if mmap is not None:
+                        where = "%s %s+%#x" % (
+                            Formattable(mmap.fmtaddr(addr)),
+                            mmap.backing, addr - mmap.start)
+                    else:
+                        where = "%#x" % addr
+                    print("%s : %d bytes %s -> %s" % (
+                        where, len(before), hexlify(before, args.width),
+                        hexlify(after, args.width)))
+
+                count += 1
+                if args.limit is not None and count >= args.limit:
+                    break
+
+        except KeyboardInterrupt:
+            print("Interrupted.")
+
+        # The pages still being looked at must go before the files do.
+        diff.close()
+        old.close()
+        if new is not None:
+            new.close()
+
+        print("%d changes." % count)
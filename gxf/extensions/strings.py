@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import gxf
+
+from gxf.formatting import Token, Formattable
+
+
+@gxf.register()
+class Strings(gxf.DataCommand):
+    '''
+    Shows the printable strings found in memory.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("what", type=gxf.LocationType(), nargs="?",
+                            help="only look from this address.")
+        parser.add_argument("until", type=gxf.LocationType(), nargs="?",
+                            help="only look until this address, defaults "
+                            "to the end of the mapping.")
+        parser.add_argument("-n", "--min-length", type=int, default=4)
+        parser.add_argument("-e", "--encoding", action="append",
+                            choices=gxf.memory.STRENCODINGS,
+                            help="defaults to all of them.")
+        parser.add_argument("-p", "--perms", default="r",
+                            help="only look in mappings with "
+                            "those permissions, defaults to r.")
+        parser.add_argument("-m", "--mapping", default=None,
+                            help="only look in mappings with "
+                            "a backing containing this.")
+        parser.add_argument("-w", "--width", type=int, default=50,
+                            help="truncate strings to about this length.")
+        parser.add_argument("-l", "--limit", type=int, default=None,
+                            help="stop after this many strings.")
+
+    def run(self, args):
+
+        memory = gxf.get_memory()
+
+        mmaps = [m for m in memory.mapindex
+                 if all(p in m.perms for p in args.perms)
+                 if args.mapping is None or args.mapping in (m.backing or "")]
+
+        if args.what is not None:
+            start = int(args.what)
+            if args.until is not None:
+                end = int(args.until)
+            else:
+                end = memory.get_map(start).end
+            mmaps = [gxf.MMap(max(start, m.start), min(end, m.end),
+                              m.perms, m.backing)
+                     for m in mmaps if m.start < end and start < m.end]
+
+        count = 0
+
+        try:
+            for addr, mmap, encoding, string in memory.strings(
+                    args.min_length, mmaps,
+                    args.encoding or gxf.memory.STRENCODINGS):
+
+                print("%s %s%s" % (
+                    Formattable(mmap.fmtaddr(addr)),
+                    "(%s) " % encoding if encoding != "ascii" else "",
+                    Formattable(((Token.Comment, gxf.memory.repr_long_str(
+                        string, args.width)),))))
+
+                count += 1
+                if args.limit is not None and count >= args.limit:
+                    break
+
+        except KeyboardInterrupt:
+            print("Interrupted.")
+
+        print("%d strings." % count)
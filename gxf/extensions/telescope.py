@@ -22,13 +22,30 @@ class Telescope(gxf.DataCommand):
         start = args.what - args.before * size
         end = args.until or args.what + args.count * size
 
-        memory = gxf.Memory()
+        memory = gxf.get_memory()
 
         # FIXME: WTF. need to find a gdb solution or a gxf hack.
         def posint(x): return int(x) & 0xffffffffffffffff
-        for addr in range(posint(start), posint(end), posint(size)):
+        addrs = range(posint(start), posint(end), posint(size))
+        if not addrs:
+            return
+
+        # Get and classify all the values in one go, we only need to
+        # follow the chains of those that look like valid pointers.
+        # If that isn't possible (eg. we're crossing into unmapped
+        # memory) each refchain will read its own first value as usual.
+        try:
+            size = (len(addrs) - 1) * addrs.step + memory.ptrsize
+            data = memory.read(addrs.start, size)
+            slots = memory.classify(data, addrs.step)
+        except gxf.MemoryError:
+            slots = [(None, gxf.memory.UNKNOWN)] * len(addrs)
+
+        for addr, (value, label) in zip(addrs, slots):
             offset = addr - posint(args.what)
-            refchain = memory.refchain(addr)
+            follow = label is gxf.memory.UNKNOWN
+            follow = follow or label in gxf.memory.POINTERS
+            refchain = memory.refchain(addr, value=value, follow=follow)
 
             print("%2.d " % (offset, ), end="")
             refchain.output()
@@ -14,6 +14,6 @@ class Vmaps(gxf.DataCommand):
 
     def run(self, args):
 
-        memory = gxf.Memory()
+        memory = gxf.get_memory()
 
         memory.output(args.what)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import gxf
+
+
+@gxf.register("xref-mem")
+class XrefMem(gxf.DataCommand):
+    '''
+    Finds every pointer to an address, a range or some mappings.
+    '''
+
+    def setup(self, parser):
+        parser.add_argument("what", type=gxf.LocationType(), nargs="?")
+        parser.add_argument("until", type=gxf.LocationType(), nargs="?")
+        parser.add_argument("-m", "--mapping", action="append", default=[],
+                            help="look for pointers into all the mappings "
+                            "with a backing containing this.")
+        parser.add_argument("-p", "--perms", default="w",
+                            help="only look in mappings with "
+                            "those permissions, defaults to w.")
+        parser.add_argument("-l", "--limit", type=int, default=None,
+                            help="stop after this many references.")
+
+    def run(self, args):
+
+        memory = gxf.get_memory()
+
+        ranges = []
+        if args.what is not None:
+            start = int(args.what)
+            end = int(args.until) if args.until is not None else start + 1
+            ranges.append((start, end))
+
+        for name in args.mapping:
+            ranges.extend((m.start, m.end) for m in memory.mapindex
+                          if name in (m.backing or ""))
+
+        if not ranges:
+            exit("Nothing to look for.")
+
+        mmaps = [m for m in memory.mapindex
+                 if all(p in m.perms for p in args.perms)]
+
+        count = 0
+
+        try:
+            for addr, mmap, value in memory.xrefs(ranges, mmaps):
+
+                try:
+                    target = memory.get_section_or_map(value)
+                except gxf.MemoryError:
+                    target = gxf.MMap(None, None, "u")
+
+                print("%s %s+%#x : %s" % (
+                    gxf.Formattable(mmap.fmtaddr(addr)),
+                    mmap.backing, addr - mmap.start,
+                    gxf.Formattable(target.fmtaddr(value))))
+
+                count += 1
+                if args.limit is not None and count >= args.limit:
+                    break
+
+        except KeyboardInterrupt:
+            print("Interrupted.")
+
+        print("%d references." % count)
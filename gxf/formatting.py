@@ -9,6 +9,8 @@ formatter = TerminalFormatter(bg="dark")
 
 class Formattable(object):
 
+    __slots__ = ("_tokens",)
+
     def __init__(self, tokens=None):
         if tokens is not None:
             self._tokens = tokens
@@ -1,7 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import os
+import re
+import sys
+import time
+import codecs
+import array
+import errno
 import struct
+import bisect
 import itertools
+import collections
+
+from contextlib import contextmanager
 
 import gxf
 import gdb
@@ -67,8 +78,44 @@ def repr_long_str(s, maxl=None, maxc=6):
     return " + ".join(rep)
 
 
-class RefChain(list, gxf.Formattable):
-    def __init__(self, memory, addr, maxlen=4):
+class Link(object):
+    """
+    One step of a RefChain, this unpacks and indexes like the
+    (addr, mmap, value, rep) lists it replaces.
+    """
+
+    __slots__ = ("addr", "mmap", "value", "rep")
+
+    def __init__(self, addr, mmap, value, rep):
+        self.addr = addr
+        self.mmap = mmap
+        self.value = value
+        self.rep = rep
+
+    def __iter__(self):
+        yield self.addr
+        yield self.mmap
+        yield self.value
+        yield self.rep
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, i):
+        return getattr(self, self.__slots__[i])
+
+    def __setitem__(self, i, value):
+        setattr(self, self.__slots__[i], value)
+
+
+class RefChain(gxf.Formattable):
+    """
+    The Links followed from an address, this indexes like a list.
+    """
+
+    __slots__ = ("links", "abreviated", "symbols")
+
+    def __init__(self, memory, addr, maxlen=4, value=None, follow=True):
 
         chain = []
 
@@ -76,32 +123,28 @@ class RefChain(list, gxf.Formattable):
 
             addr = addr if isinstance(addr, int) else int(addr)
 
-            if any(x[0] == addr for x in chain):
+            if any(x.addr == addr for x in chain):
                 val = ...
                 break
 
-            try:
-                m = memory.get_section_or_map(addr)
-            except gxf.MemoryError:
-                # We have no idea about this memory map,
-                # but if are not about to break it means we
-                # it's still a valid address. Fake it.
-                m = MMap(None, None, "u")
+            # If the caller already read the first value we use it.
+            m, val = memory.resolve(addr, value)
+            value = None
 
-            try:
-                val = memory.read_ptr(addr)
-                val.fetch_lazy()
-            except gxf.MemoryError:
+            if val is None:
                 break
 
-            rep = int(val) & 0xffffffffffffffff
-            chain.append([addr, m, val, rep])
+            chain.append(Link(addr, m, val, val))
             addr = val
 
+            if not follow:
+                # The caller knows this doesn't lead anywhere.
+                break
+
         if not chain:
             # This wasn't even a valid pointer. We use the wanabee
             # address as value. (maybe taken from a register or other)
-            chain.append([None, None, addr, addr])
+            chain.append(Link(None, None, addr, addr))
 
         self.abreviated = max(0, len(chain) - maxlen)
         if self.abreviated:
@@ -109,14 +152,28 @@ class RefChain(list, gxf.Formattable):
 
         # Now we examine the last element of the chain and we
         # try to find a better representation of its value.
+        # This is expensive so it is remembered for the whole stop.
         addr, m, val, _ = chain[-1]
-        chain[-1][3] = self.guesstype(memory, addr, m, val)
+        reps = memory.resolved()[1]
+        if (addr, val) not in reps:
+            reps[addr, val] = self.guesstype(memory, addr, m, val)
+        chain[-1].rep = reps[addr, val]
 
-        self.chain = chain
+        self.symbols = [None if x.addr is None else memory.symbolize(x.addr)
+                        for x in chain]
 
-        list.__init__(self, self.chain)
+        self.links = chain
         gxf.Formattable.__init__(self)
 
+    def __len__(self):
+        return len(self.links)
+
+    def __iter__(self):
+        return iter(self.links)
+
+    def __getitem__(self, i):
+        return self.links[i]
+
     def guesstype(self, memory, addr, m, val):
 
         # TODO: We should take little/big endian into account
@@ -167,22 +224,38 @@ class RefChain(list, gxf.Formattable):
 
         if m is not None and "x" in m.perms:
             # Not a string and executable, this might be disassembly.
-            disline = gxf.disassemble_lines(addr, ignfct=True).lines[0]
-            if disline.inst is not None:
-                return disline
+            try:
+                lines = gxf.disassemble_lines(addr, ignfct=True).lines
+            except gxf.MemoryError:
+                # The instruction goes over the end of the mapping.
+                lines = []
+            if lines and lines[0].inst is not None:
+                return lines[0]
 
         # Not a string, not disassembly, what else?
         return aval
 
+    def fmtsymbol(self, i):
+        if self.symbols[i] is not None:
+            name, offset = self.symbols[i]
+            yield (Token.Text, " ")
+            yield (Token.Operator, "<")
+            yield (Token.Name.Variable, name)
+            if offset:
+                yield (Token.Operator, "+")
+                yield (Token.Literal.Number.Integer, "%d" % offset)
+            yield (Token.Operator, ">")
+
     def fmttokens(self):
 
         first = True
 
-        for addr, m, val, rep in self[:-1]:
+        for i, (addr, m, val, rep) in enumerate(self[:-1]):
             if not first:
                 yield (Token.Comment, " : ")
             first = False
             yield from m.fmtaddr(addr)
+            yield from self.fmtsymbol(i)
 
         if not first:
             if not self.abreviated:
@@ -207,6 +280,7 @@ class RefChain(list, gxf.Formattable):
         else:
             if mmap is not None and addr is not None:
                 yield from mmap.fmtaddr(addr)
+                yield from self.fmtsymbol(-1)
                 yield (Token.Comment, " : ")
 
             if isinstance(rep, gxf.Formattable):
@@ -223,8 +297,35 @@ class RefChain(list, gxf.Formattable):
             else:
                 raise RuntimeError("Can't format %r of type %r." % (val, type(val)))
 
+
+class RelativeAddresses(gdb.Parameter):
+    """
+    When this is on addresses are shown relative to the first mapping
+    of their backing, eg. libc.so.6+0x1234, these don't change between
+    runs. Such addresses are always understood as arguments.
+    """
+
+    set_doc = "Set whether addresses are shown as backing+offset."
+    show_doc = "Show whether addresses are shown as backing+offset."
+
+    def __init__(self):
+        super().__init__("gx-relative", gdb.COMMAND_DATA, gdb.PARAM_BOOLEAN)
+        self.value = False
+
+    def get_set_string(self):
+        return ""
+
+    def get_show_string(self, svalue):
+        return "Relative addresses are %s." % svalue
+
+
+relativeaddresses = RelativeAddresses()
+
+
 class MMap(gxf.Formattable):
 
+    __slots__ = ("start", "end", "perms", "backing", "comment", "base")
+
     def __init__(self, start, end, perms, backing=None, comment=None):
         if not backing:
             backing = None
@@ -234,6 +335,9 @@ class MMap(gxf.Formattable):
         self.backing = backing
         self.comment = None
 
+        # Start of the first mapping of the same backing, if known.
+        self.base = None
+
     def __contains__(self, addr):
         return self.start <= addr < self.end
 
@@ -275,13 +379,29 @@ class MMap(gxf.Formattable):
         else:
             token = Token.Text
 
-        yield (token, "%#.x" % addr)
+        # Sections are shared between stops, their base is that of the
+        # mapping they're in which the Memory knows.
+        relative = None
+        if relativeaddresses.value:
+            try:
+                relative = get_memory().relative(addr)
+            except ValueError:
+                pass
+
+        if relative is not None:
+            backing, offset = relative
+            yield (token, "%s+%#x" % (os.path.basename(backing), offset))
+        else:
+            yield (token, "%#.x" % addr)
 
 
 class Section(MMap):
 
-    def __init__(self, start, end, name, tags):
+    __slots__ = ("tags", "objfile")
+
+    def __init__(self, start, end, name, tags, objfile=None):
         self.tags = tags
+        self.objfile = objfile
 
         perms = "%s%s%sp" % ("r",
                              "w" if not "READONLY" in tags else "-",
@@ -290,17 +410,660 @@ class Section(MMap):
         super().__init__(start, end, perms, name, comment=" ".join(self.tags))
 
 
+class MMapIndex(object):
+    """
+    Sorted index of mappings, lookups bisect on the start addresses.
+    Mappings are allowed to overlap, the running maximum of the end
+    addresses tells us when it's useless to look further back.
+    """
+
+    def __init__(self, mmaps):
+        self.mmaps = sorted(mmaps, key=lambda m: (m.start, m.end))
+        self.starts = [m.start for m in self.mmaps]
+        self.maxends = list(itertools.accumulate(
+            (m.end for m in self.mmaps), max))
+
+    def __len__(self):
+        return len(self.mmaps)
+
+    def __iter__(self):
+        yield from self.mmaps
+
+    def find(self, addr):
+        i = bisect.bisect_right(self.starts, addr) - 1
+        while i >= 0 and self.maxends[i] > addr:
+            if addr < self.mmaps[i].end:
+                return self.mmaps[i]
+            i -= 1
+        return None
+
+
+class GdbMemoryBackend(object):
+    """
+    Reads memory through gdb, this works for any kind of target.
+    """
+
+    name = "gdb"
+
+    def __init__(self, inferior):
+        self.inf = inferior
+        self.pid = inferior.pid
+
+    @classmethod
+    def available(cls, inferior):
+        return True
+
+    def read(self, addr, size):
+        try:
+            return self.inf.read_memory(addr, size).tobytes()
+        except gdb.MemoryError as e:
+            raise gxf.MemoryError(e)
+
+    def close(self):
+        pass
+
+
+class ProcMemoryBackend(object):
+    """
+    Reads memory using pread on /proc/<pid>/mem, this is only possible
+    for native inferiors that gdb itself is tracing. We can't see gdb's
+    breakpoints, that's not a problem because they are removed when the
+    inferior stops unless they are always inserted or we are non-stop.
+    """
+
+    name = "proc"
+
+    def __init__(self, inferior):
+        self.pid = inferior.pid
+        self.fd = os.open("/proc/%d/mem" % self.pid, os.O_RDONLY)
+
+    @classmethod
+    def available(cls, inferior):
+
+        if inferior.pid <= 0:
+            return False
+
+        try:
+            if gdb.parameter("non-stop"):
+                return False
+            if gdb.parameter("breakpoint always-inserted"):
+                return False
+        except RuntimeError:
+            pass
+
+        # If we aren't the ones tracing it this is probably a remote
+        # or a core target that happens to share this pid.
+        try:
+            with open("/proc/%d/status" % inferior.pid) as status:
+                for line in status:
+                    if line.startswith("TracerPid:"):
+                        return int(line.split()[1]) == os.getpid()
+        except (IOError, ValueError):
+            pass
+
+        return False
+
+    def read(self, addr, size):
+
+        data = []
+        done = 0
+
+        while done < size:
+            try:
+                chunk = os.pread(self.fd, size - done, addr + done)
+            except OSError as e:
+                if e.errno not in (errno.EIO, errno.EFAULT, errno.EINVAL):
+                    raise
+                chunk = None
+            except OverflowError:
+                chunk = None
+            if not chunk:
+                raise gxf.MemoryError(addr + done)
+            data.append(chunk)
+            done += len(chunk)
+
+        return b"".join(data)
+
+    def close(self):
+        os.close(self.fd)
+
+
+backends = [ProcMemoryBackend, GdbMemoryBackend]
+
+
+def get_backend(inferior):
+    for backend in backends:
+        if backend.available(inferior):
+            try:
+                return backend(inferior)
+            except OSError:
+                continue
+    raise RuntimeError("No memory backend for inferior %d." % inferior.num)
+
+
+class PageCache(object):
+    """
+    Page granular cache of an inferior's memory. Pages are read on first
+    touch and kept until the inferior's memory might have changed.
+    Pages we failed to read are cached as None.
+    """
+
+    def __init__(self, inferior, pagesize=4096):
+        self.inf = inferior
+        self.pagesize = pagesize
+        self.pages = {}
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self._backend = None
+
+    @property
+    def backend(self):
+        # The backend depends on the process, so we check for a new one.
+        if self._backend is None or self._backend.pid != self.inf.pid:
+            if self._backend is not None:
+                self._backend.close()
+            self._backend = get_backend(self.inf)
+        return self._backend
+
+    def flush(self):
+        if self.pages:
+            self.flushes += 1
+        self.pages.clear()
+
+    def _fetch(self, first, count):
+
+        try:
+            data = self.backend.read(first, count * self.pagesize)
+        except gxf.MemoryError as e:
+            # At least one of them is not readable. Everything before the
+            # faulty page can still be read in one go, after it we have
+            # to check page by page.
+            bad = (e.address - first) // self.pagesize
+            if count == 1:
+                self.pages[first] = None
+            elif 0 <= bad < count:
+                if bad:
+                    self._fetch(first, bad)
+                self.pages[first + bad * self.pagesize] = None
+                for i in range(bad + 1, count):
+                    self._fetch(first + i * self.pagesize, 1)
+            else:
+                for i in range(count):
+                    self._fetch(first + i * self.pagesize, 1)
+            return
+
+        for i in range(count):
+            self.pages[first + i * self.pagesize] = data[
+                i * self.pagesize:(i + 1) * self.pagesize]
+
+    def read(self, addr, size):
+
+        first = addr - addr % self.pagesize
+        pages = range(first, addr + size, self.pagesize)
+
+        # Group the missing pages so that contiguous ones
+        # are fetched using a single read.
+        missing = None
+        for page in itertools.chain(pages, (None,)):
+            if page is not None and page not in self.pages:
+                self.misses += 1
+                if missing is None:
+                    missing = [page, 0]
+                missing[1] += 1
+                continue
+            if missing is not None:
+                self._fetch(*missing)
+                missing = None
+            if page is not None:
+                self.hits += 1
+
+        data = []
+        for page in pages:
+            if self.pages[page] is None:
+                raise gxf.MemoryError(max(page, addr))
+            data.append(self.pages[page])
+
+        data = b"".join(data)
+        return data[addr - first:addr - first + size]
+
+
+pagecaches = {}
+
+
+def get_pagecache(inferior):
+    if inferior.num not in pagecaches:
+        pagecaches[inferior.num] = PageCache(inferior)
+    return pagecaches[inferior.num]
+
+
+def flush_pagecaches(*args, **kwargs):
+    for cache in pagecaches.values():
+        cache.flush()
+
+
+gxf.events.cont.connect(flush_pagecaches)
+gxf.events.exited.connect(flush_pagecaches)
+gxf.events.memory_changed.connect(flush_pagecaches)
+gxf.events.new_objfile.connect(flush_pagecaches)
+
+
+memorystats = collections.OrderedDict(
+    (what, [0, 0.0]) for what in (
+        "memory built", "memory reused", "maps parsed", "sections parsed"))
+
+
+@contextmanager
+def _accounted(what):
+    start = time.time()
+    yield
+    memorystats[what][0] += 1
+    memorystats[what][1] += time.time() - start
+
+
+memories = {}
+
+
+def get_memory(inferior=None):
+    """
+    Returns the Memory of the given (by default the selected) inferior.
+    The same snapshot is shared by everyone until the inferior resumes,
+    this way maps and sections are parsed only once per stop.
+    """
+
+    if inferior is None:
+        inferior = gxf.inferiors.get_selected_inferior()
+
+    key = inferior.pid, gxf.events.stopgen.value
+    cached = memories.get(inferior.num)
+
+    if cached is not None and cached[0] == key:
+        memorystats["memory reused"][0] += 1
+        return cached[1]
+
+    with _accounted("memory built"):
+        memory = Memory(inferior)
+
+    memories[inferior.num] = key, memory
+    return memory
+
+
+def _parse_sections(lines, objfile=None):
+
+    sections = []
+
+    for line in lines:
+        try:
+            _, startend, _, _, name, tags = line.split(None, 5)
+            start, end = (int(x, 16) for x in startend.split("->"))
+        except:
+            continue
+        tags = tags.split()
+        if "LOAD" in tags:
+            sections.append(Section(start, end, name, tags, objfile))
+
+    return sections
+
+
+def _split_objfiles(data):
+    """
+    Splits the output of `maintenance info sections` and yields
+    (kind, filename, lines) for each file it lists.
+    """
+
+    kind = filename = None
+    lines = []
+
+    for line in data.splitlines():
+
+        if line.lstrip().startswith("["):
+            lines.append(line)
+            continue
+
+        if "file:" in line:
+            if kind is not None:
+                yield kind, filename, lines
+            kind, filename, lines = line.split()[0].lower(), None, []
+            line = line.split("file:", 1)[1]
+            if line.strip() and "`" not in line:
+                filename = line.strip()
+
+        # Some gdbs give the exec filename on the next line.
+        if filename is None and "`" in line:
+            filename = line.split("`", 1)[1].split("'", 1)[0]
+
+    if kind is not None:
+        yield kind, filename, lines
+
+
+# (filename, build-id) -> (first line, sections) of each objfile.
+sectioncache = {}
+loadedsections = [None, []]
+
+
+def drop_sections(event):
+    objfile = event.new_objfile
+    sectioncache.pop((objfile.filename,
+                      getattr(objfile, "build_id", None)), None)
+
+
+def clear_sections(*args, **kwargs):
+    sectioncache.clear()
+
+
+gxf.events.new_objfile.connect(drop_sections)
+gxf.events.clear_objfiles.connect(clear_sections)
+
+
+def get_sections():
+    """
+    Returns the loaded sections of the exec file, shared libraries
+    are left to the mappings. gdb is asked again only after objfiles
+    changed, and a file is parsed again only if it's new or if its
+    first section moved because it was relocated.
+    """
+
+    if loadedsections[0] == gxf.events.objfilegen.value:
+        return loadedsections[1]
+
+    buildids = dict((o.filename, getattr(o, "build_id", None))
+                    for o in gdb.objfiles())
+
+    sections = []
+
+    for _, filename, lines in _split_objfiles(
+            gxf.execute("maintenance info sections")):
+
+        key = filename, buildids.get(filename)
+        first = lines[0] if lines else None
+        cached = sectioncache.get(key)
+
+        if cached is None or cached[0] != first:
+            with _accounted("sections parsed"):
+                cached = first, _parse_sections(lines, filename)
+            sectioncache[key] = cached
+
+        sections.extend(cached[1])
+
+    loadedsections[:] = gxf.events.objfilegen.value, sections
+    return sections
+
+
+# (path, build-id, mtime) -> SymbolIndex of files we mapped.
+symbolindexes = {}
+
+
+def get_symbolindex(path):
+    """
+    Returns the SymbolIndex of an ELF file, or None if we can't read it.
+    Indexes are kept for as long as the file doesn't change.
+    """
+
+    try:
+        with gxf.ELF(path) as elf:
+            key = path, elf.build_id, os.path.getmtime(path)
+            if key not in symbolindexes:
+                symbolindexes[key] = gxf.SymbolIndex(elf)
+    except (IOError, ValueError):
+        return None
+
+    return symbolindexes[key]
+
+
+BYTES = "bytes"
+HEX = "hex"
+INT = "int"
+REGEX = "regex"
+
+
+class Pattern(object):
+    """
+    Something to search for in memory. Literals are searched with
+    bytes.find and matches may overlap, regexes use re.finditer.
+    maxlen is None when we can't know how long a match will be.
+    """
+
+    def __init__(self, name, literal=None, regex=None):
+        self.name = name
+        self.literal = literal
+        self.regex = regex
+        self.maxlen = len(literal) if literal is not None else None
+
+    def finditer(self, data, addr=0):
+        """
+        Yields (offset, pattern, match) for every match in data,
+        pattern is always this one. addr doesn't matter here.
+        """
+
+        if self.regex is not None:
+            for match in self.regex.finditer(data):
+                yield match.start(), self, match.group()
+            return
+
+        if not self.literal:
+            return
+
+        find = data.find
+        idx = find(self.literal)
+        while idx >= 0:
+            yield idx, self, self.literal
+            idx = find(self.literal, idx + 1)
+
+
+# Array typecodes for the widths we can look up in a hash.
+_typecodes = dict((array.array(t).itemsize, t) for t in "QLIHB")
+
+
+class PatternSet(object):
+    """
+    Several patterns matched during a single pass over memory. Literals
+    are merged into one regex, the one matching at a given offset is
+    the longest and shorter literals prefixing it are matched too.
+    If aligned is set, literals of 1, 2, 4 or 8 bytes are looked up in
+    a hash of values instead and only match at aligned addresses.
+    Regexes each scan the same buffer.
+    """
+
+    def __init__(self, patterns, aligned=False):
+
+        self.patterns = list(patterns)
+
+        maxlens = [p.maxlen for p in self.patterns]
+        self.maxlen = None if None in maxlens else max(maxlens + [1])
+
+        self.regexes = [p for p in self.patterns if p.regex is not None]
+
+        self.literals = collections.OrderedDict()
+        for p in self.patterns:
+            if p.literal:
+                self.literals.setdefault(p.literal, []).append(p)
+
+        self.hashed = {}
+        merged = []
+
+        for literal in self.literals:
+            if aligned and len(literal) in _typecodes:
+                values = self.hashed.setdefault(len(literal), {})
+                values[int.from_bytes(literal, sys.byteorder)] = literal
+            else:
+                merged.append(literal)
+
+        merged.sort(key=len, reverse=True)
+
+        self.prefixes = dict((literal, [shorter for shorter in merged
+                                        if len(shorter) < len(literal)
+                                        if literal.startswith(shorter)])
+                             for literal in merged)
+
+        self.merged = None
+        if merged:
+            self.merged = re.compile(b"|".join(re.escape(literal)
+                                               for literal in merged))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __iter__(self):
+        yield from self.patterns
+
+    def finditer(self, data, addr=0):
+        """
+        Yields (offset, pattern, match) for every match of every pattern,
+        they are not sorted by offset. addr is where data is in memory.
+        """
+
+        if self.merged is not None:
+            search = self.merged.search
+            match = search(data)
+            while match is not None:
+                found = match.group()
+                for literal in [found] + self.prefixes[found]:
+                    for p in self.literals[literal]:
+                        yield match.start(), p, literal
+                match = search(data, match.start() + 1)
+
+        for width, values in self.hashed.items():
+            first = -addr % width
+            last = len(data) - (len(data) - first) % width
+            slots = array.array(_typecodes[width], data[first:last])
+            for value in set(values).intersection(slots):
+                literal = values[value]
+                idx = data.find(literal)
+                while idx >= 0:
+                    if not (addr + idx) % width:
+                        for p in self.literals[literal]:
+                            yield idx, p, literal
+                    idx = data.find(literal, idx + 1)
+
+        for p in self.regexes:
+            yield from p.finditer(data)
+
+
+def compile_pattern(pattern, kind=BYTES, width=8, byteorder="little"):
+    """
+    Builds a Pattern from what the user gave us. BYTES understands python
+    escapes, HEX ignores whitespace and an optional 0x, INT packs the
+    value on `width` bytes and REGEX is a python regex over bytes.
+    """
+
+    if kind == REGEX:
+        regex = pattern.encode("utf8") if isinstance(pattern, str) else pattern
+        return Pattern(pattern, regex=re.compile(regex, re.DOTALL))
+
+    if kind == HEX:
+        text = "".join(pattern.split())
+        if text.lower().startswith("0x"):
+            text = text[2:]
+        literal = bytes.fromhex(text)
+    elif kind == INT:
+        value = int(pattern, 0) & ((1 << width * 8) - 1)
+        literal = value.to_bytes(width, byteorder)
+    elif isinstance(pattern, str):
+        literal = codecs.escape_decode(pattern.encode("utf8"))[0]
+    else:
+        literal = pattern
+
+    return Pattern(pattern, literal=literal)
+
+
+def _topbytes(first, last, size, byteorder):
+    """
+    Yields (literal, offset) so that every pointer sized value in
+    [first, last] has one of the literals at offset in its bytes.
+    """
+
+    if first > last:
+        return
+
+    for common in range(size, 0, -1):
+        shift = 8 * (size - common)
+        if first >> shift == last >> shift:
+            literal = (first >> shift).to_bytes(common, byteorder)
+            yield literal, size - common if byteorder == "little" else 0
+            return
+
+    # Not even the top byte is shared, we split the range on it.
+    shift = 8 * (size - 1)
+    for top in range(first >> shift, (last >> shift) + 1):
+        yield from _topbytes(max(first, top << shift),
+                             min(last, ((top + 1) << shift) - 1),
+                             size, byteorder)
+
+
+dfltstrmaxlen = 4096
+
+STRENCODINGS = ("ascii", "utf-16le")
+_strchars = r"\t\x20-\x7e"
+
+
+def _strregex(encoding, minlen):
+    if encoding == "ascii":
+        regex = r"[%s]{%d,}" % (_strchars, minlen)
+    elif encoding == "utf-16le":
+        regex = r"(?:[%s]\x00){%d,}" % (_strchars, minlen)
+    else:
+        raise ValueError("Can't look for %s strings." % encoding)
+    return re.compile(regex.encode("ascii"))
+
+
+# Memory is searched in chunks this big. Regexes can't tell us how long
+# their matches are so they get this much overlap between chunks.
+dfltchunksize = 1 << 24
+dfltoverlap = 4096
+
+PTR_RWX = "rwx"
+PTR_RX = "rx"
+PTR_RW = "rw"
+PTR_R = "r"
+PTR_WX = "wx"
+PTR_X = "x"
+PTR_W = "w"
+PTR_NONE = "---"
+POINTERS = (PTR_RWX, PTR_RX, PTR_RW, PTR_R, PTR_WX, PTR_X, PTR_W, PTR_NONE)
+
+STRING = "string"
+SMALLINT = "smallint"
+OTHER = "other"
+UNKNOWN = None
+
+# Bytes we consider printable in strings, nullbytes are allowed too.
+_printable = bytes(range(0x20, 0x7f)) + b"\t\n\r\x00"
+
+
 class Memory(gxf.Formattable):
 
-    def __init__(self):
+    def __init__(self, inferior=None):
 
-        self.inf = gxf.inferiors.get_selected_inferior()
+        if inferior is None:
+            inferior = gxf.inferiors.get_selected_inferior()
+        self.inf = inferior
 
         if not self.inf.threads():
             raise ValueError("inferior is not running")
 
-        self.maps = self._read_maps()
-        self.sections = self._read_sections()
+        self.cache = get_pagecache(self.inf)
+        self._resolved = None, None, None
+        self._symbols = {}
+
+        self.ptrsize = gxf.cpu.get_addrsz()
+        self.byteorder = gxf.cpu.get_byteorder()
+        self.ptrarray = {4: "I", 8: "Q"}[self.ptrsize]
+        self.ptrfmt = "%s%s" % ("<" if self.byteorder == "little" else ">",
+                                self.ptrarray)
+
+        with _accounted("maps parsed"):
+            self.maps = self._read_maps()
+        self.sections = get_sections()
+
+        self.bases = {}
+        self.basenames = {}
+        for m in self.maps:
+            if m.backing is not None:
+                m.base = self.bases.setdefault(m.backing, m.start)
+                self.basenames.setdefault(os.path.basename(m.backing), m.base)
+
+        self.mapindex = MMapIndex(self.maps)
+        self.sectionindex = MMapIndex(self.sections)
 
     def _read_maps(self):
 
@@ -323,64 +1086,452 @@ class Memory(gxf.Formattable):
 
         return maps
 
-    def _read_sections(self):
-        data = gxf.execute("maintenance info sections")
+    def read(self, addr, size, cache=True):
 
-        sections = []
+        if cache:
+            return self.cache.read(addr, size)
+        return self.cache.backend.read(addr, size)
 
-        for line in data.splitlines()[2:]:
-            try:
-                _, startend, _, _, name, tags = line.split(None, 5)
-                start, end = (int(x, 16) for x in startend.split("->"))
-            except:
-                continue
-            tags = tags.split()
-            if "LOAD" in tags:
-                sections.append(Section(start, end, name, tags))
-
-        return sections
-
-    def read_ptr(self, addr):
-        # TODO: maybe use read_memory stuff ?
+    def write(self, addr, data):
+        """
+        Writes data in a single call through gdb, which is what lets it
+        notify everyone that the memory changed.
+        """
 
         try:
-            val = gxf.parse_and_eval("*(void **)%#x" % addr)
-            val.fetch_lazy()
+            self.inf.write_memory(addr, data)
         except gdb.MemoryError as e:
             raise gxf.MemoryError(e)
 
-        return val
+    def read_ptrs(self, addr, count, step=None):
+        """
+        Reads `count` pointers starting at `addr` using a single read.
+        Pointers are `step` bytes appart, by default they are contiguous.
+        """
+
+        step = step or self.ptrsize
+        if count <= 0:
+            return []
+
+        data = self.read(addr, (count - 1) * step + self.ptrsize)
+        return [struct.unpack_from(self.ptrfmt, data, i * step)[0]
+                for i in range(count)]
+
+    def read_ptr(self, addr):
+        return self.read_ptrs(addr, 1)[0]
+
+    def read_str(self, addr, encoding="utf8", errors="strict", maxlen=None):
+        """
+        Reads a nul terminated string of at most maxlen bytes. When we know
+        the mapping we read until its end at once, otherwise we read until
+        the end of the page and then what's left.
+        """
+
+        if maxlen is None:
+            maxlen = dfltstrmaxlen
+
+        # This is the size of a code unit, for utf-16 we want 2.
+        unit = len("\x00\x00".encode(encoding)) - len("\x00".encode(encoding))
+        nul = b"\x00" * unit
+
+        mmap = self.mapindex.find(addr)
+        if mmap is not None:
+            ends = [min(addr + maxlen, mmap.end)]
+        else:
+            pagesize = self.cache.pagesize
+            ends = [min(addr + maxlen, addr - addr % pagesize + pagesize),
+                    addr + maxlen]
+
+        data = b""
+        for end in ends:
+
+            if end <= addr + len(data):
+                continue
 
-    def read_str(self, addr, *args, maxlen=4096, **kwargs):
-        while maxlen is not None and maxlen > 1:
             try:
-                ptr = gxf.parse_and_eval("*(char (*)[%d])%#x" % (maxlen, addr))
-                return ptr.string(*args, **kwargs)
-            except:
-                maxlen = maxlen / 2 if maxlen > 16 else 0
-        ptr = gxf.parse_and_eval("(char *)%#x" % addr)
-        return ptr.string(*args, **kwargs)
+                data += self.read(addr + len(data), end - addr - len(data))
+            except gxf.MemoryError:
+                if not data:
+                    raise
+                break
 
-    def get_section_or_map(self, addr):
-        for s in self.sections:
-            if addr in s:
-                return s
-        for m in self.maps:
-            if addr in m:
-                return m
+            # Look for an aligned terminator.
+            idx = data.find(nul)
+            while idx >= 0 and idx % unit:
+                idx = data.find(nul, idx + 1)
+
+            if idx >= 0:
+                data = data[:idx]
+                break
+
+        return data.decode(encoding, errors)
+
+    def resolved(self):
+        """
+        Returns the links and representations resolved during this stop.
+        They are shared by all refchains and dropped when memory changes.
+        """
+        if self._resolved[0] != gxf.events.memgen.value:
+            self._resolved = gxf.events.memgen.value, {}, {}
+        return self._resolved[1:]
+
+    def resolve(self, addr, value=None):
+        """
+        Returns the mapping of addr and the pointer it contains, or None if
+        it can't be read. If the caller already read the pointer he can
+        give it to us as value.
+        """
+
+        links = self.resolved()[0]
+        if addr in links:
+            return links[addr]
+
+        try:
+            m = self.get_section_or_map(addr)
+        except gxf.MemoryError:
+            # We have no idea about this memory map,
+            # but if are not about to break it means we
+            # it's still a valid address. Fake it.
+            m = MMap(None, None, "u")
+
+        if value is None:
+            try:
+                value = self.read_ptr(addr)
+            except gxf.MemoryError:
+                pass
+
+        links[addr] = m, value
+        return m, value
+
+    def _find(self, addr, *indexes):
+        for index in indexes:
+            mmap = index.find(addr)
+            if mmap is not None:
+                return mmap
         raise gxf.MemoryError(addr)
 
+    def get_section_or_map(self, addr):
+        return self._find(addr, self.sectionindex, self.mapindex)
+
     def get_map(self, addr):
-        for m in self.maps:
-            if addr in m:
-                return m
-        for s in self.sections:
-            if addr in s:
-                return s
-        raise gxf.MemoryError(addr)
+        return self._find(addr, self.mapindex, self.sectionindex)
+
+    def _symbolindex(self, backing):
+        """
+        Returns (base, index) for the file backing some mappings, or
+        None. This is done once per backing for this Memory.
+        """
+
+        if backing not in self._symbols:
+
+            index = get_symbolindex(backing)
+            if index is None:
+                self._symbols[backing] = None
+            else:
+                self._symbols[backing] = (
+                    self.bases[backing] - index.minvaddr, index)
+
+        return self._symbols[backing]
+
+    def relative(self, addr):
+        """
+        Returns (backing, offset) of addr from the start of the first
+        mapping of its backing, or None.
+        """
+
+        m = self.mapindex.find(addr)
+        if m is None or m.base is None:
+            return None
+        return m.backing, addr - m.base
+
+    def lookup(self, backing, offset=0):
+        """
+        Returns the address at offset from the first mapping of backing,
+        which can be a path or a basename, or None if nothing matches.
+        """
+
+        base = self.bases.get(backing, self.basenames.get(backing))
+        if base is None:
+            return None
+        return base + offset
+
+    def _symbolindexfor(self, addr):
+        m = self.mapindex.find(addr)
+        if m is None or not m.backing or not m.backing.startswith("/"):
+            return None
+        return self._symbolindex(m.backing)
+
+    def symbolize(self, addr):
+        """
+        Returns (name, offset) of the symbol containing addr or None.
+        This only uses the symbol tables of the mapped files.
+        """
+
+        found = self._symbolindexfor(addr)
+        if found is None:
+            return None
+
+        base, index = found
+        return index.lookup(addr - base)
+
+    def symbolrange(self, addr):
+        """
+        Returns (name, start, end) of the sized symbol containing addr
+        or None, like symbolize this only uses our own index.
+        """
+
+        found = self._symbolindexfor(addr)
+        if found is None:
+            return None
+
+        base, index = found
+        found = index.range(addr - base)
+        if found is None:
+            return None
+
+        name, start, end = found
+        return name, base + start, base + end
+
+    def refchain(self, addr, value=None, follow=True):
+        return RefChain(self, addr, value=value, follow=follow)
+
+    def classify(self, data, step=None):
+        """
+        Unpacks all the pointer sized slots of data at once and labels
+        them. Slots are `step` bytes appart, by default contiguous.
+        Returns a list of (value, label) where label is the permissions
+        of the mapping the value points to (eg. "rw", "rx" or PTR_NONE)
+        if any, STRING, SMALLINT, OTHER or UNKNOWN if we have no maps to
+        check. Values are sorted and merged with the mappings in a single
+        pass, instead of looking each of them up.
+        """
+
+        step = step or self.ptrsize
+        count = (len(data) - self.ptrsize) // step + 1 if data else 0
+
+        if step == self.ptrsize:
+            values = array.array(self.ptrarray, data[:count * step])
+            if self.byteorder != sys.byteorder:
+                values.byteswap()
+        else:
+            values = [struct.unpack_from(self.ptrfmt, data, i * step)[0]
+                      for i in range(count)]
+
+        if not self.mapindex:
+            return [(value, UNKNOWN) for value in values]
+
+        index = self.mapindex
+        mmaps, starts, maxends = index.mmaps, index.starts, index.maxends
+        labels = [None] * len(values)
+
+        j = -1
+        last = len(starts) - 1
+
+        for i in sorted(range(len(values)), key=values.__getitem__):
+
+            value = values[i]
+            while j < last and starts[j + 1] <= value:
+                j += 1
+
+            # j is the last mapping starting before value, only if they
+            # overlap do we need to look further back.
+            mmap = None
+            if j >= 0 and value < mmaps[j].end:
+                mmap = mmaps[j]
+            elif j >= 0 and value < maxends[j]:
+                mmap = index.find(value)
+
+            if mmap is not None:
+                perms = mmap.perms[:3].replace("-", "")
+                labels[i] = value, perms or PTR_NONE
+                continue
+
+            if value < 256:
+                labels[i] = value, SMALLINT
+                continue
+
+            slot = data[i * step:i * step + self.ptrsize].rstrip(b"\x00")
+            if len(slot) >= 3 and not slot.translate(None, _printable):
+                labels[i] = value, STRING
+            else:
+                labels[i] = value, OTHER
+
+        return labels
+
+    def stream(self, start, end, chunksize=None, overlap=0):
+        """
+        Reads [start, end[ by chunks of chunksize bytes, each followed by
+        up to overlap bytes of the next one. Yields (addr, data, limit)
+        for each chunk, anything found at or after limit will be found
+        again in the next chunk. Unreadable pages are skipped, this
+        bypasses the page cache.
+        """
+
+        chunksize = chunksize or dfltchunksize
+        pagesize = self.cache.pagesize
+
+        addr = start
+        while addr < end:
+
+            size = min(chunksize + overlap, end - addr)
+
+            try:
+                data = self.read(addr, size, cache=False)
+            except gxf.MemoryError as e:
+                # Give what we could read and skip the faulty page.
+                bad = e.address if addr < e.address < addr + size else addr
+                if bad > addr:
+                    try:
+                        data = self.read(addr, bad - addr, cache=False)
+                    except gxf.MemoryError:
+                        pass
+                    else:
+                        yield addr, data, bad
+                addr = bad - bad % pagesize + pagesize
+                continue
+
+            yield addr, data, min(addr + chunksize, end)
+            addr += chunksize
+
+    def search(self, pattern, mmaps=None, chunksize=None, progress=None):
+        """
+        Lazily yields (addr, mmap, pattern, match) for each match of
+        pattern in the given mappings, by default all the readable ones.
+        pattern can be a PatternSet, all of them are matched while reading
+        memory only once. progress is called with the number of bytes
+        done and the total.
+        """
+
+        chunksize = chunksize or dfltchunksize
+
+        if mmaps is None:
+            mmaps = [m for m in self.mapindex if "r" in m.perms]
+
+        overlap = max(pattern.maxlen or dfltoverlap, 1) - 1
+        total = sum(m.end - m.start for m in mmaps)
+        done = 0
+
+        for mmap in mmaps:
+
+            # A regex's matches don't overlap, one starting within the
+            # last one is what's left of it at the start of a chunk.
+            ends = {}
+
+            for addr, data, limit in self.stream(mmap.start, mmap.end,
+                                                 chunksize, overlap):
+
+                for offset, found, match in pattern.finditer(data, addr):
+
+                    # The ones in the overlap belong to the next chunk.
+                    start = addr + offset
+                    if start >= limit:
+                        continue
+
+                    if found.regex is not None:
+                        if start < ends.get(found, start):
+                            continue
+                        ends[found] = start + len(match)
+
+                    yield start, mmap, found, match
+
+                if progress is not None:
+                    progress(done + limit - mmap.start, total)
+
+            done += mmap.end - mmap.start
+
+    def xrefs(self, ranges, mmaps=None, chunksize=None, progress=None):
+        """
+        Lazily yields (addr, mmap, value) for every aligned pointer in the
+        given mappings, by default the writable ones, whose value is in
+        one of the [start, end[ ranges. Instead of unpacking every slot we
+        look for the top bytes that all the values in a range share and
+        only check the slots where we find them.
+        """
+
+        chunksize = chunksize or dfltchunksize
+        size = self.ptrsize
+        ranges = [(int(start), int(end)) for start, end in ranges]
+
+        if mmaps is None:
+            mmaps = [m for m in self.mapindex if "w" in m.perms]
+
+        # (literal, offset of the literal in a slot)
+        needles = set()
+        for start, end in ranges:
+            needles.update(_topbytes(start, end - 1, size, self.byteorder))
+
+        total = sum(m.end - m.start for m in mmaps)
+        done = 0
+
+        for mmap in mmaps:
+            for addr, data, limit in self.stream(mmap.start, mmap.end,
+                                                 chunksize):
+
+                slots = set()
+                for literal, offset in needles:
+                    idx = data.find(literal, offset)
+                    while idx >= 0:
+                        if not (addr + idx - offset) % size:
+                            slots.add(idx - offset)
+                        idx = data.find(literal, idx + 1)
+
+                for slot in sorted(slots):
+                    if slot + size > len(data):
+                        continue
+                    value = struct.unpack_from(self.ptrfmt, data, slot)[0]
+                    if any(start <= value < end for start, end in ranges):
+                        yield addr + slot, mmap, value
+
+                if progress is not None:
+                    progress(done + limit - mmap.start, total)
+
+            done += mmap.end - mmap.start
+
+    def strings(self, minlen=4, mmaps=None, encodings=STRENCODINGS,
+                chunksize=None, progress=None):
+        """
+        Lazily yields (addr, mmap, encoding, string) for all the runs of at
+        least minlen printable characters in the given mappings, by default
+        all the readable ones. encodings can contain "ascii" and "utf-16le".
+        Strings longer than dfltoverlap might be truncated.
+        """
+
+        chunksize = chunksize or dfltchunksize
+
+        if mmaps is None:
+            mmaps = [m for m in self.mapindex if "r" in m.perms]
+
+        regexes = [(encoding, _strregex(encoding, minlen))
+                   for encoding in encodings]
+
+        total = sum(m.end - m.start for m in mmaps)
+        done = 0
 
-    def refchain(self, addr):
-        return RefChain(self, addr)
+        for mmap in mmaps:
+
+            # Where the last string found for each encoding ended, so that
+            # we don't report the end of a long one as a new one.
+            ends = dict((encoding, mmap.start) for encoding in encodings)
+
+            for addr, data, limit in self.stream(mmap.start, mmap.end,
+                                                 chunksize, dfltoverlap):
+
+                for encoding, regex in regexes:
+                    for match in regex.finditer(data):
+                        start = addr + match.start()
+                        if start >= limit:
+                            break
+                        previous = ends[encoding]
+                        ends[encoding] = addr + match.end()
+                        if start < previous:
+                            continue
+                        yield (start, mmap, encoding,
+                               match.group().decode(encoding))
+
+                if progress is not None:
+                    progress(done + limit - mmap.start, total)
+
+            done += mmap.end - mmap.start
 
     def fmttokens(self, address=None):
         for mmap in sorted(itertools.chain(self.sections, self.maps)):
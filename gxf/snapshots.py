@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import mmap
+import json
+import time
+import array
+import bisect
+import struct
+import hashlib
+
+import gxf
+
+
+def hashpage(data):
+    return hashlib.sha1(data).digest()[:16]
+
+
+class Snapshot(object):
+    """
+    A copy of (part of) an inferior's memory saved in a file which we
+    mmap. After the header and some padding come the pages, then the
+    page table (addresses followed by hashes) and the json metadata.
+    Pages full of zeros aren't written, they stay holes in the file.
+    """
+
+    magic = b"GXFSNAP\x00"
+    version = 1
+
+    # magic, version, metadata offset and length.
+    header = struct.Struct("<8sIQI")
+
+    def __init__(self, path):
+
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, metaoff, metalen = self.header.unpack_from(self.map)
+        if magic != self.magic or version > self.version:
+            raise ValueError("%s is not a gxf snapshot we know." % path)
+
+        self.meta = json.loads(
+            self.map[metaoff:metaoff + metalen].decode("utf8"))
+
+        self.pagesize = self.meta["pagesize"]
+        self.maps = [gxf.MMap(*m) for m in self.meta["maps"]]
+
+        count, table = self.meta["count"], self.meta["table"]
+        self.addrs = array.array("Q")
+        self.addrs.frombytes(self.map[table:table + 8 * count])
+        if sys.byteorder != "little":
+            self.addrs.byteswap()
+
+        self.hashes = memoryview(self.map)[
+            table + 8 * count:table + 24 * count]
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def find(self, addr):
+        """
+        Returns the index of the page containing addr or None.
+        """
+        i = bisect.bisect_right(self.addrs, addr) - 1
+        if i >= 0 and addr < self.addrs[i] + self.pagesize:
+            return i
+        return None
+
+    def hash(self, i):
+        return self.hashes[i * 16:(i + 1) * 16].tobytes()
+
+    def page(self, i):
+        start = self.meta["data"] + i * self.pagesize
+        return memoryview(self.map)[start:start + self.pagesize]
+
+    def pages(self):
+        """
+        Yields (addr, hash, data) for all the pages, without copying.
+        """
+        for i, addr in enumerate(self.addrs):
+            yield addr, self.hash(i), self.page(i)
+
+    def dirty(self, memory):
+        """
+        Yields (first, last) for each run of contiguous pages which differ
+        from the live inferior, pages it can't read are not included.
+        Live pages are compared with the mapped ones, nothing is hashed.
+        """
+
+        run = None
+        pagesize = self.pagesize
+
+        for addr, page in self._livepages(memory):
+
+            i = self.find(addr)
+            if i is None:
+                continue
+
+            # Slicing the mmap gives bytes, comparing those is a memcmp
+            # where memoryviews would go item by item.
+            start = self.meta["data"] + i * pagesize
+            if self.map[start:start + pagesize] == page:
+                continue
+
+            if run is not None and run[1] == i and \
+               self.addrs[i - 1] + pagesize == addr:
+                run[1] = i + 1
+                continue
+
+            if run is not None:
+                yield tuple(run)
+            run = [i, i + 1]
+
+        if run is not None:
+            yield tuple(run)
+
+    def _livepages(self, memory):
+        """
+        Yields (addr, data) for the readable pages of our mappings, this
+        is livepages without the hashes.
+        """
+        for m in self.maps:
+            for addr, chunk, limit in memory.stream(m.start, m.end):
+                end = len(chunk) - len(chunk) % self.pagesize
+                for i in range(0, end, self.pagesize):
+                    yield addr + i, chunk[i:i + self.pagesize]
+
+    def restore(self, memory):
+        """
+        Writes back the pages which differ from the live inferior, each
+        run of contiguous pages is written at once. Registers aren't
+        restored here. Returns the number of pages written.
+        """
+
+        # Those are consecutive in the file so we can write them as is.
+        runs = list(self.dirty(memory))
+        for first, last in runs:
+            start = self.meta["data"] + first * self.pagesize
+            stop = start + (last - first) * self.pagesize
+            data = memoryview(self.map)[start:stop]
+            try:
+                memory.write(self.addrs[first], data)
+            finally:
+                data.release()
+
+        return sum(last - first for first, last in runs)
+
+    def restore_registers(self):
+        """
+        Sets back the registers which changed, returns the ones gdb
+        refused to set. Some, like segment registers, usually can't be.
+        """
+
+        current = gxf.Registers().regs
+        failed = []
+
+        for reg, value in self.meta.get("registers", {}).items():
+            if current.get(reg) == value:
+                continue
+            try:
+                gxf.execute("set $%s = %#x" % (reg, value))
+            except gxf.GdbError:
+                failed.append(reg)
+
+        return failed
+
+    def close(self):
+        self.hashes.release()
+        self.map.close()
+
+    @classmethod
+    def save(cls, path, memory, mmaps=None, registers=None):
+        """
+        Saves the given mappings, by default all the readable ones.
+        Unreadable pages are left out. The registers are only kept in
+        the metadata, they should map names to values.
+        """
+
+        if mmaps is None:
+            mmaps = [m for m in memory.mapindex if "r" in m.perms]
+
+        pagesize = memory.cache.pagesize
+        zeros = bytes(pagesize)
+
+        addrs = array.array("Q")
+        hashes = []
+
+        with open(path, "wb") as f:
+
+            offset = data = pagesize
+
+            for addr, digest, page in livepages(memory, mmaps):
+                addrs.append(addr)
+                hashes.append(digest)
+                if page != zeros:
+                    f.seek(offset)
+                    f.write(page)
+                offset += pagesize
+
+            if sys.byteorder != "little":
+                addrs.byteswap()
+
+            f.seek(offset)
+            f.write(addrs.tobytes())
+            f.write(b"".join(hashes))
+
+            meta = json.dumps({
+                "pagesize": pagesize,
+                "pid": memory.inf.pid,
+                "time": time.time(),
+                "maps": [[m.start, m.end, m.perms, m.backing] for m in mmaps],
+                "registers": dict(registers or {}),
+                "count": len(hashes),
+                "table": offset,
+                "data": data,
+                }).encode("utf8")
+
+            metaoff = f.tell()
+            f.write(meta)
+
+            f.seek(0)
+            f.write(cls.header.pack(cls.magic, cls.version,
+                                    metaoff, len(meta)))
+
+        return cls(path)
+
+
+def livepages(memory, mmaps):
+    """
+    Yields (addr, hash, data) for all the readable pages of the given
+    mappings, pages which can only be partially read are left out.
+    """
+    pagesize = memory.cache.pagesize
+    for m in mmaps:
+        for addr, chunk, limit in memory.stream(m.start, m.end):
+            for i in range(0, len(chunk) - len(chunk) % pagesize, pagesize):
+                page = chunk[i:i + pagesize]
+                yield addr + i, hashpage(page), page
+
+
+def diffbytes(addr, old, new, block=64):
+    """
+    Yields (addr, old, new) for each run of bytes that differ.
+    """
+
+    start = None
+    i = 0
+
+    while i < len(old):
+
+        if start is None and old[i:i + block] == new[i:i + block]:
+            i += block
+            continue
+
+        if old[i] != new[i]:
+            if start is None:
+                start = i
+        elif start is not None:
+            yield addr + start, bytes(old[start:i]), bytes(new[start:i])
+            start = None
+
+        i += 1
+
+    if start is not None:
+        yield addr + start, bytes(old[start:]), bytes(new[start:])
+
+
+def diffpages(old, new):
+    """
+    Compares two streams of (addr, hash, data) sorted by address. Yields
+    (addr, old, new) for each run of bytes that changed, pages which are
+    missing on one side are given entirely with None for the other.
+    Only the pages whose hashes differ are compared byte per byte.
+    """
+
+    old, new = iter(old), iter(new)
+    a, b = next(old, None), next(new, None)
+
+    while a is not None or b is not None:
+
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a[0], bytes(a[2]), None
+            a = next(old, None)
+
+        elif a is None or b[0] < a[0]:
+            yield b[0], None, bytes(b[2])
+            b = next(new, None)
+
+        else:
+            if a[1] != b[1]:
+                yield from diffbytes(a[0], a[2], b[2])
+            a, b = next(old, None), next(new, None)
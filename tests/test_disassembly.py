@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_disassembly
+----------------------------------
+
+Tests for `gxf.disassembly` module, those need to run inside gdb.
+"""
+
+import unittest
+
+import gxf
+
+if gxf.GDB:
+    from gxf import disassembly
+
+
+MSG = "Dump of assembler code for function main:"
+
+INTEL = [
+    ("55", "push   rbp"),
+    ("48 89 e5", "mov    rbp,rsp"),
+    ("48 83 ec 10", "sub    rsp,0x10"),
+    ("89 7d fc", "mov    DWORD PTR [rbp-0x4],edi"),
+    ("48 8d 3d cc 0e 00 00", "lea    rdi,[rip+0xecc]        # 0x402004"),
+    ("e8 f3 fe ff ff", "call   0x401030 <puts@plt>"),
+    ("f3 48 ab", "rep stos QWORD PTR es:[rdi],rax"),
+    ("64 48 8b 04 25 28 00 00 00", "mov    rax,QWORD PTR fs:0x28"),
+    ("74 02", "je     0x40114d <main+39>"),
+    ("f2 c3", "bnd ret"),
+    ("66 0f 1f 44 00 00", "nop    WORD PTR [rax+rax*1+0x0]"),
+    ("c9", "leave"),
+    ("c3", "ret"),
+    ]
+
+ATT = [
+    ("55", "push   %rbp"),
+    ("48 89 e5", "mov    %rsp,%rbp"),
+    ("48 83 ec 10", "sub    $0x10,%rsp"),
+    ("89 7d fc", "mov    %edi,-0x4(%rbp)"),
+    ("48 8d 3d cc 0e 00 00", "lea    0xecc(%rip),%rdi        # 0x402004"),
+    ("e8 f3 fe ff ff", "callq  0x401030 <puts@plt>"),
+    ("f3 48 ab", "rep stos %rax,%es:(%rdi)"),
+    ("64 48 8b 04 25 28 00 00 00", "mov    %fs:0x28,%rax"),
+    ("74 02", "je     0x40114d <main+39>"),
+    ("f2 c3", "bnd retq"),
+    ("66 0f 1f 44 00 00", "nopw   0x0(%rax,%rax,1)"),
+    ("c9", "leaveq"),
+    ("c3", "retq"),
+    ]
+
+
+def dump(instructions, base=0x401126, current=3):
+    """
+    Gives what `disassemble /r` would for these (hexdump, asm).
+    """
+
+    lines = []
+    offset = 0
+    for i, (hexdump, asm) in enumerate(instructions):
+        lines.append("%s0x%016x <+%d>:\t%s\t%s\n" % (
+            "=> " if i == current else "   ",
+            base + offset, offset, hexdump, asm))
+        offset += len(hexdump.split())
+    return "".join(lines)
+
+
+@unittest.skipUnless(gxf.GDB, "needs gdb.")
+class TestTokenizer(unittest.TestCase):
+    """
+    The tokenizer copies the rules of pygments' lexers, this makes sure
+    both still give the same tokens.
+    """
+
+    def setUp(self):
+        self.flavor = disassembly.disassemblyflavor.value
+        self.tokenizer = disassembly.tokenizer
+
+    def compare(self, flavor, instructions):
+        disassembly.disassemblyflavor.value = flavor
+        disassembly.tokenizer = disassembly.Tokenizer(flavor)
+
+        lexer = disassembly.GdbLexer()
+        lexer.add_filter(disassembly.PrefixFilter())
+        lexer.add_filter(disassembly.currentfunctiontfilter)
+        lexer.add_filter(disassembly.AlignementFilter())
+
+        # Line by line, pygments' GasLexer can keep its state from one
+        # line to the next where the tokenizer starts again.
+        for line in dump(instructions).splitlines(True):
+            expected = disassembly.DisassemblyBlock(line, lexer, MSG)
+            found = disassembly.DisassemblyBlock(line, msg=MSG)
+            assert len(expected) == len(found) == 1
+            assert found.lines[0].tokens == expected.lines[0].tokens
+            assert found.lines[0].inst == expected.lines[0].inst
+
+    def test_intel(self):
+        self.compare("intel", INTEL)
+
+    def test_att(self):
+        self.compare("att", ATT)
+
+    def tearDown(self):
+        disassembly.disassemblyflavor.value = self.flavor
+        disassembly.tokenizer = self.tokenizer
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_elf
+----------------------------------
+
+Tests for `gxf.elf` module.
+"""
+
+import sys
+import tempfile
+import unittest
+
+import gxf
+
+
+class TestElf(unittest.TestCase):
+
+    def setUp(self):
+        self.elf = gxf.ELF(sys.executable)
+
+    def test_headers(self):
+        assert self.elf.bits in (32, 64)
+        assert self.elf.header.ident[:4] == b"\x7fELF"
+        assert self.elf.segment(gxf.elf.PT_LOAD) is not None
+
+    def test_sections(self):
+        names = [s.name for s in self.elf.sections]
+        assert ".text" in names
+        assert self.elf.section(".text").flags & gxf.elf.SHF_EXECINSTR
+
+    def test_symbols(self):
+        symbols = list(self.elf.symbols(".dynsym"))
+        assert symbols and symbols[0].name == ""
+
+    def test_symbolindex(self):
+        index = gxf.SymbolIndex(self.elf)
+        for addr, size, name in self.elf.plt():
+            assert index.lookup(addr + 1)[0].endswith("@plt")
+        for symbol in self.elf.symbols(".dynsym"):
+            if symbol.value and symbol.size and symbol.shndx:
+                found = index.lookup(symbol.value + symbol.size - 1)
+                assert found[1] == symbol.size - 1
+                found = index.range(symbol.value + symbol.size - 1)
+                assert found[1:] == (symbol.value,
+                                     symbol.value + symbol.size)
+                break
+        assert index.lookup(0) is None
+
+    def test_checksec(self):
+        assert self.elf.checksec()["PIE"] in ("PIE", "No PIE")
+
+    def test_not_elf(self):
+        with self.assertRaises(ValueError):
+            gxf.ELF(__file__)
+
+    def malformed(self, data):
+        f = tempfile.NamedTemporaryFile()
+        self.addCleanup(f.close)
+        f.write(data)
+        f.flush()
+        return f.name
+
+    def test_malformed(self):
+        data = bytearray(self.elf.map)
+
+        bad = data[:]
+        bad[4] = 9
+        with self.assertRaises(ValueError):
+            gxf.ELF(self.malformed(bad))
+
+        # Cut in the middle of the section headers.
+        path = self.malformed(data[:self.elf.header.shoff + 10])
+        with gxf.ELF(path) as elf:
+            with self.assertRaises(ValueError):
+                elf.sections
+            with self.assertRaises(ValueError):
+                gxf.SymbolIndex(elf)
+
+    def tearDown(self):
+        self.elf.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_memory
+----------------------------------
+
+Tests for `gxf.memory` module, those need to run inside gdb.
+"""
+
+import unittest
+
+import gxf
+
+
+@unittest.skipUnless(gxf.GDB, "needs gdb.")
+class TestPatterns(unittest.TestCase):
+
+    def test_overlapping(self):
+        literals = [b"he", b"she", b"his", b"hers", b"s"]
+        patterns = [gxf.compile_pattern(literal) for literal in literals]
+        data = b"ushers and his sheep"
+        found = sorted((offset, match) for offset, _, match in
+                       gxf.PatternSet(patterns).finditer(data))
+        expected = sorted((i, literal) for literal in literals
+                          for i in range(len(data))
+                          if data.startswith(literal, i))
+        assert found == expected
+
+    def test_aligned(self):
+        patterns = [gxf.compile_pattern(b"\x01\x02")]
+        data = b"\x00\x01\x02\x00\x01\x02"
+        found = gxf.PatternSet(patterns, aligned=True).finditer(data, 0x1001)
+        assert [offset for offset, _, _ in found] == [1]
+
+    def test_patternset(self):
+        patterns = [gxf.compile_pattern(p) for p in ("AB", "ABC", "BC")]
+        patterns.append(gxf.compile_pattern(b"C+", gxf.memory.REGEX))
+        found = sorted((offset, p.name, match) for offset, p, match in
+                       gxf.PatternSet(patterns).finditer(b"xABCCx"))
+        assert found == [(1, "AB", b"AB"), (1, "ABC", b"ABC"),
+                         (2, "BC", b"BC"), (3, b"C+", b"CC")]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_snapshots
+----------------------------------
+
+Tests for `gxf.snapshots` module, those need to run inside gdb.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import gxf
+
+if gxf.GDB:
+    import gdb
+    import gxf.extensions  # NOQA
+
+
+class FakeInferior(object):
+    pid = 1
+
+
+class FakeCache(object):
+    pagesize = 4096
+
+
+class FakeMemory(object):
+    """
+    Just what Snapshot.save needs, pages come from a bytearray.
+    """
+
+    inf = FakeInferior()
+    cache = FakeCache()
+
+    def __init__(self, start, data):
+        self.start = start
+        self.data = data
+
+    def stream(self, start, end):
+        yield start, bytes(self.data[start - self.start:end - self.start]), end
+
+    def write(self, addr, data):
+        self.data[addr - self.start:addr - self.start + len(data)] = data
+
+
+@unittest.skipUnless(gxf.GDB, "needs gdb.")
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.start = 0x400000
+        self.data = bytearray(b"A" * 4096 * 3)
+        self.maps = [gxf.MMap(self.start, self.start + len(self.data),
+                              "rw-p", "[heap]")]
+
+    def save(self, name):
+        path = os.path.join(self.tmpdir, name)
+        memory = FakeMemory(self.start, self.data)
+        gxf.Snapshot.save(path, memory, self.maps).close()
+        return path
+
+    def test_diffpages(self):
+        old = self.save("old")
+        self.data[4096 + 8:4096 + 12] = b"BBBB"
+        new = self.save("new")
+
+        old, new = gxf.Snapshot(old), gxf.Snapshot(new)
+        changes = list(gxf.diffpages(old.pages(), new.pages()))
+        old.close()
+        new.close()
+
+        assert changes == [(self.start + 4096 + 8, b"AAAA", b"BBBB")]
+
+    def test_restore(self):
+        snapshot = gxf.Snapshot(self.save("old"))
+        self.data[4096 + 8:4096 + 12] = b"BBBB"
+        self.data[2 * 4096:2 * 4096 + 4] = b"CCCC"
+
+        memory = FakeMemory(self.start, self.data)
+        assert list(snapshot.dirty(memory)) == [(1, 3)]
+        assert snapshot.restore(memory) == 2
+        snapshot.close()
+
+        assert self.data == bytearray(b"A" * 4096 * 3)
+
+    def test_diff_command(self):
+        old = self.save("old")
+        self.data[8:12] = b"BBBB"
+        new = self.save("new")
+
+        output = gdb.execute("gx snapshot diff %s %s" % (old, new),
+                             False, True)
+        assert "41414141 -> 42424242" in output
+        assert "1 changes." in output
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()